@@ -1,7 +1,29 @@
 #!/usr/bin/env python
 
-from gi.repository import Gtk
+import argparse
+import math
+import sys
+from gi.repository import GLib, Gtk
 import scarlett
+import scarlett_latency
+import scarlett_meter
+import scarlett_monitor
+
+
+def source_level(config, levels, mixer_src):
+    """Get the peak level of a mixer source from a dict of meter levels."""
+    index = config["mixer_src"].get(mixer_src)
+    if mixer_src.startswith("DAW"):
+        meters = levels['daw']
+    else:
+        # hardware inputs follow the DAW channels in the source enumeration
+        meters = levels['input']
+        num_daw = len([src for src in config["mixer_src"]
+                       if src.startswith("DAW")])
+        index = None if index is None else index - num_daw
+    if index is None or not 0 <= index < len(meters):
+        return -128.0
+    return min(max(meters[index], -128.0), 6.0)
 
 
 # _____________________________________________________________________________
@@ -9,7 +31,8 @@ import scarlett
 
 class RedBeetWindow(Gtk.Window):
 
-    def __init__(self):
+    def __init__(self, trace_latency=False, meters=False,
+                 meter_process=False):
         Gtk.Window.__init__(self, title="RedBeet")
         self.set_border_width(10)
         self.set_default_size(400, 600)
@@ -20,9 +43,17 @@ class RedBeetWindow(Gtk.Window):
         self.hb.props.subtitle = "Mix1 (inactive)"
         self.set_titlebar(self.hb)
 
-        # instance variables
-        self.device = scarlett.ScarlettDevice()
+        # instance variables; with meter_process, meters are read in a worker
+        # process that also owns the device
+        self.meters = None
+        if meter_process:
+            self.meters = scarlett_meter.MeterProcess()
+            self.device = scarlett.ScarlettDevice(self.meters.device)
+        else:
+            self.device = scarlett.ScarlettDevice()
         self.notebook = Gtk.Notebook()
+        # widgets of the router page: parameter -> (widget, handler id)
+        self.widgets = dict()
 
         # router notebook
         router_vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
@@ -36,7 +67,9 @@ class RedBeetWindow(Gtk.Window):
                 src_combo.append(id=src, text=src)
             src_combo.set_active_id("OFF")
             src_combo.set_wrap_width(4)
-            src_combo.connect("changed", self.on_src_combo_changed, dest)
+            handler_id = src_combo.connect("changed",
+                                           self.on_src_combo_changed, dest)
+            self.widgets[("route", dest)] = (src_combo, handler_id)
             dest_vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
             dest_vbox.pack_start(dest_label, False, False, 5)
             dest_vbox.pack_start(src_combo, False, False, 5)
@@ -49,7 +82,9 @@ class RedBeetWindow(Gtk.Window):
         for imp in sorted(self.device.config["imp_switch"].keys()):
             imp_label = Gtk.Label.new(imp)
             imp_button = Gtk.ToggleButton.new_with_label("LINE/MIC")
-            imp_button.connect("toggled", self.on_impedance_toggled, imp)
+            handler_id = imp_button.connect("toggled",
+                                            self.on_impedance_toggled, imp)
+            self.widgets[("impedance", imp)] = (imp_button, handler_id)
             imp_vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
             imp_vbox.pack_start(imp_label, False, False, 5)
             imp_vbox.pack_start(imp_button, False, False, 5)
@@ -62,7 +97,9 @@ class RedBeetWindow(Gtk.Window):
         for pad in sorted(self.device.config["pad_switch"].keys()):
             pad_label = Gtk.Label.new(pad)
             pad_button = Gtk.ToggleButton.new_with_label("OFF")
-            pad_button.connect("toggled", self.on_pad_toggled, pad)
+            handler_id = pad_button.connect("toggled", self.on_pad_toggled,
+                                            pad)
+            self.widgets[("pad", pad)] = (pad_button, handler_id)
             pad_vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
             pad_vbox.pack_start(pad_label, False, False, 5)
             pad_vbox.pack_start(pad_button, False, False, 5)
@@ -77,46 +114,143 @@ class RedBeetWindow(Gtk.Window):
         router_vbox.pack_start(imp_frame, False, False, 5)
         router_vbox.pack_start(pad_frame, False, False, 5)
 
-        for mixer_out in sorted(self.device.config["mixer_out"]):
+        mixer_outs = sorted(self.device.config["mixer_out"])
+        for mixer_out in mixer_outs:
             self.notebook.append_page(MonoMixerPanel(self.device, mixer_out),
                                       Gtk.Label(mixer_out))
+        # stereo pairs of mixes: MIX1/MIX2, MIX3/MIX4, ...
+        for mixer_out_l, mixer_out_r in zip(mixer_outs[0::2],
+                                            mixer_outs[1::2]):
+            self.notebook.append_page(
+                StereoMixerPanel(self.device, mixer_out_l, mixer_out_r),
+                Gtk.Label("%s/%s" % (mixer_out_l, mixer_out_r)))
+        self.router_page = router_vbox
         self.notebook.append_page(router_vbox, Gtk.Label("Router"))
+        self.monitor_page = MonitorPanel(self.device)
+        self.notebook.append_page(self.monitor_page, Gtk.Label("Monitor"))
         self.notebook.connect("switch-page", self.on_notebook_switched_page)
 
-        self.add(self.notebook)
+        # change notification: widgets that show a parameter, by parameter;
+        # changes made elsewhere (scripts, automation, other pages) are
+        # applied to these widgets only
+        self.watchers = dict()
+        for page_num in range(self.notebook.get_n_pages()):
+            page = self.notebook.get_nth_page(page_num)
+            for strip in getattr(page, "all_strips", []):
+                for parameter in strip.parameters():
+                    self.watchers.setdefault(parameter, []).append(strip)
+        for parameter in self.widgets:
+            self.watchers.setdefault(parameter, []).append(self)
+        self.device.subscribe(self.on_device_changes)
+
+        # latency tracing: overlay with p50/p99 latencies per control type
+        self.latency_label = None
+        if trace_latency:
+            self.device.latency = scarlett_latency.LatencyTracer()
+            self.latency_label = Gtk.Label.new("latency p50/p99: -")
+            self.latency_label.set_halign(Gtk.Align.START)
+            GLib.timeout_add_seconds(1, self.on_latency_timeout)
+
+        # peak meters are only polled on request; in-process reads compete
+        # with the control transfers for the device
+        if meters or meter_process:
+            GLib.timeout_add(50, self.on_meter_timeout)
+
+        main_vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+        main_vbox.pack_start(self.notebook, True, True, 0)
+        if self.latency_label is not None:
+            main_vbox.pack_start(self.latency_label, False, False, 5)
+        self.add(main_vbox)
 
     def on_src_combo_changed(self, combo, dest):
-        self.device.route_mix(combo.get_active_text(), dest)
+        with scarlett_latency.gesture(self.device, "route"), \
+                self.device.change_origin(self):
+            self.device.route_mix(combo.get_active_text(), dest)
 
     def on_impedance_toggled(self, button, name):
-        if button.get_active():
-            button.set_label("INSTRUMENT")
-            self.device.set_impedance(name, scarlett.IMPEDANCE_INST)
-        else:
-            button.set_label("LINE/MIC")
-            self.device.set_impedance(name, scarlett.IMPEDANCE_LINE)
+        with scarlett_latency.gesture(self.device, "impedance"), \
+                self.device.change_origin(self):
+            if button.get_active():
+                button.set_label("INSTRUMENT")
+                self.device.set_impedance(name, scarlett.IMPEDANCE_INST)
+            else:
+                button.set_label("LINE/MIC")
+                self.device.set_impedance(name, scarlett.IMPEDANCE_LINE)
 
     def on_pad_toggled(self, button, name):
-        if button.get_active():
-            button.set_label("-10 dB")
-            self.device.set_pad(name, scarlett.PAD_ON)
+        with scarlett_latency.gesture(self.device, "pad"), \
+                self.device.change_origin(self):
+            if button.get_active():
+                button.set_label("-10 dB")
+                self.device.set_pad(name, scarlett.PAD_ON)
+            else:
+                button.set_label("OFF")
+                self.device.set_pad(name, scarlett.PAD_OFF)
+
+    def on_device_changes(self, events):
+        # called from the thread that changed the device; apply the changes
+        # in the main loop
+        GLib.idle_add(self.apply_device_changes, events)
+
+    def apply_device_changes(self, events):
+        for event in events:
+            for watcher in self.watchers.get(event.parameter, []):
+                if event.origin is not watcher:  # skip a widget's own edits
+                    watcher.on_device_change(event)
+        return False  # False = run only once
+
+    def on_device_change(self, event):
+        widget, handler_id = self.widgets[event.parameter]
+        widget.handler_block(handler_id)
+        if event.parameter[0] == "route":
+            widget.set_active_id(event.new)
+        elif event.parameter[0] == "impedance":
+            widget.set_active(event.new == scarlett.IMPEDANCE_INST)
+            widget.set_label("INSTRUMENT" if widget.get_active()
+                             else "LINE/MIC")
+        elif event.parameter[0] == "pad":
+            widget.set_active(event.new == scarlett.PAD_ON)
+            widget.set_label("-10 dB" if widget.get_active() else "OFF")
+        widget.handler_unblock(handler_id)
+
+    def on_meter_timeout(self):
+        if self.meters is not None:
+            frame = self.meters.ring.latest()
+            if frame is None:
+                return True
+            levels = frame[1]
         else:
-            button.set_label("OFF")
-            self.device.set_pad(name, scarlett.PAD_OFF)
+            try:
+                levels = self.device.get_peak_meters()
+            except ValueError:
+                return True  # dropped or failed read; try again next time
+        page = self.notebook.get_nth_page(self.notebook.get_current_page())
+        for strip in getattr(page, "mixer_strip_list", []):
+            strip.update_level(levels)
+        return True  # True = keep the timeout running
+
+    def on_latency_timeout(self):
+        self.latency_label.set_text("latency p50/p99: %s" %
+                                    self.device.latency.summary())
+        return True  # True = keep the timeout running
 
     def on_notebook_switched_page(self, notebook, page, page_num):
-        if page_num == len(self.device.config["mixer_out"]):
+        if page is self.router_page:
             self.hb.props.subtitle = "Router & Switches"
+        elif page is self.monitor_page:
+            self.hb.props.subtitle = "Monitor Controller"
         else:
-            self.hb.props.subtitle = "MIX%d (%s)" % (page_num+1, "inactive")
+            self.hb.props.subtitle = "%s (%s)" % (
+                notebook.get_tab_label_text(page), "inactive")
 
 
 # _____________________________________________________________________________
 
 
-class MonoMixerMonoStrip(Gtk.Frame):
+class MixerStrip(Gtk.Frame):
+    """Base class of the mixer strips: source selector, fader, level meter."""
 
-    def __init__(self, device, mixer_out, mixer_in, mixer_src="OFF"):
+    def __init__(self, device, mixer_in, mixer_src="OFF"):
         Gtk.Frame.__init__(self)
         self.set_label(None)
 
@@ -124,16 +258,9 @@ class MonoMixerMonoStrip(Gtk.Frame):
         self.device = device
         self.mixer_src = mixer_src
         self.mixer_in = mixer_in
-        self.mixer_out = mixer_out
-        self.gain = 0
 
-        self.combo_src = Gtk.ComboBoxText.new()
-        for src in sorted(device.config["mixer_src"]):
-            # id string and text string are the same:
-            self.combo_src.append(id=src, text=src)
-        self.combo_src.set_active_id("OFF")
-        self.combo_src.set_wrap_width(4)
-        self.combo_src.connect("changed", self.on_combo_src_changed)
+        self.combo_src, self.combo_src_handler = self.new_combo_src(
+            self.on_combo_src_changed)
 
         self.gain_fader = Gtk.Scale.new_with_range(Gtk.Orientation.VERTICAL,
                                                    -128, 6, 10)
@@ -145,6 +272,8 @@ class MonoMixerMonoStrip(Gtk.Frame):
         # add mark: unicode:minus, unicode:infinity
         self.gain_fader.add_mark(-128, Gtk.PositionType.LEFT, u"\u2212\u221e")
         self.gain_fader.connect("change-value", self.on_gain_changed)
+        # the fader starts at its lower limit (muted); keep the gain in sync
+        self.gain = self.gain_fader.get_value()
 
         self.level_bar = Gtk.LevelBar.new_for_interval(-128.0, 6.0)
         self.level_bar.set_orientation(Gtk.Orientation.VERTICAL)
@@ -156,25 +285,41 @@ class MonoMixerMonoStrip(Gtk.Frame):
 
         self.vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
         self.vbox.pack_start(self.combo_src, False, False, 0)
-        self.vbox.pack_start(self.hbox, True, True, 0)
+        self.vbox.pack_end(self.hbox, True, True, 0)
 
         self.add(self.vbox)
 
+    def new_combo_src(self, callback, *args):
+        combo = Gtk.ComboBoxText.new()
+        for src in sorted(self.device.config["mixer_src"]):
+            # id string and text string are the same:
+            combo.append(id=src, text=src)
+        combo.set_active_id("OFF")
+        combo.set_wrap_width(4)
+        handler_id = combo.connect("changed", callback, *args)
+        return combo, handler_id
+
+    def set_combo_src(self, combo, handler_id, mixer_src):
+        combo.handler_block(handler_id)
+        combo.set_active_id(mixer_src)
+        combo.handler_unblock(handler_id)
+
     def on_combo_src_changed(self, combo):
         mixer_src = combo.get_active_text()
         if mixer_src is not None:
-            self.device.set_mixer_source(mixer_src, self.mixer_in)
+            with scarlett_latency.gesture(self.device, "mixer_source"), \
+                    self.device.change_origin(self):
+                self.device.set_mixer_source(mixer_src, self.mixer_in)
             print "DEBUG: Connect mixer_src=%s with mixer_in=%s" \
                 % (mixer_src, self.mixer_in)
             # GLib.free(mixer_src)
             # TODO: documentation says mixer_src must be freed. However, doing
             # so gives a ValueError...I am confused.
 
-    def on_gain_changed(self, gtk_range, scroll_type, value):
-        self.device.set_mixer_gain(self.mixer_in, self.mixer_out, value)
-        print "DEBUG: Set mixer matrix element in=%s, out=%s to value=%g dB" \
-            % (self.mixer_in, self.mixer_out, value)
-        return False  # False = further process signal (e.g., fader animation)
+    def update_level(self, levels):
+        mixer_src = self.combo_src.get_active_text()
+        self.level_bar.set_value(source_level(self.device.config, levels,
+                                              mixer_src or "OFF"))
 
     def get_mixer_src(self):
         return self.mixer_src
@@ -186,6 +331,36 @@ class MonoMixerMonoStrip(Gtk.Frame):
 # _____________________________________________________________________________
 
 
+class MonoMixerMonoStrip(MixerStrip):
+
+    def __init__(self, device, mixer_out, mixer_in, mixer_src="OFF"):
+        self.mixer_out = mixer_out
+        MixerStrip.__init__(self, device, mixer_in, mixer_src)
+
+    def on_gain_changed(self, gtk_range, scroll_type, value):
+        with scarlett_latency.gesture(self.device, "mixer_gain"), \
+                self.device.change_origin(self):
+            self.device.set_mixer_gain(self.mixer_in, self.mixer_out, value)
+        print "DEBUG: Set mixer matrix element in=%s, out=%s to value=%g dB" \
+            % (self.mixer_in, self.mixer_out, value)
+        return False  # False = further process signal (e.g., fader animation)
+
+    def parameters(self):
+        return [("mixer_source", self.mixer_in),
+                ("mixer_gain", self.mixer_in, self.mixer_out)]
+
+    def on_device_change(self, event):
+        if event.parameter[0] == "mixer_source":
+            self.set_combo_src(self.combo_src, self.combo_src_handler,
+                               event.new)
+        else:
+            self.gain = event.new
+            self.gain_fader.set_value(event.new)
+
+
+# _____________________________________________________________________________
+
+
 class MonoMixerPanel(Gtk.Bin):
 
     def __init__(self, device, mixer_out):
@@ -196,12 +371,13 @@ class MonoMixerPanel(Gtk.Bin):
 
         self.hbox = Gtk.HBox()
 
-        mixer_strip_list = list()
+        self.mixer_strip_list = list()
         for strip in range(18):
             mixer_in = "CH_%02d" % (strip+1)
             ms = MonoMixerMonoStrip(self.device, mixer_out, mixer_in)
-            mixer_strip_list.append(ms)
+            self.mixer_strip_list.append(ms)
             self.hbox.pack_start(ms, False, False, 0)
+        self.all_strips = self.mixer_strip_list
 
         self.add(self.hbox)
 
@@ -209,7 +385,291 @@ class MonoMixerPanel(Gtk.Bin):
 # _____________________________________________________________________________
 
 
-w = RedBeetWindow()
+class StereoMixerStrip(MixerStrip):
+    """A mono input panned into a stereo pair of mixes."""
+
+    def __init__(self, device, mixer_out_l, mixer_out_r, mixer_in,
+                 mixer_src="OFF"):
+        self.mixer_out_l = mixer_out_l
+        self.mixer_out_r = mixer_out_r
+        self.pan = 0.0
+        MixerStrip.__init__(self, device, mixer_in, mixer_src)
+
+        # pan knob: -100 (hard left) .. +100 (hard right)
+        self.pan_scale = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL,
+                                                  -100, 100, 1)
+        self.pan_scale.set_digits(0)
+        self.pan_scale.set_value(0)
+        self.pan_scale.add_mark(0, Gtk.PositionType.BOTTOM, "C")
+        self.pan_scale.connect("change-value", self.on_pan_changed)
+        self.vbox.pack_start(self.pan_scale, False, False, 0)
+
+    def parameters(self):
+        return [("mixer_source", self.mixer_in),
+                ("mixer_gain", self.mixer_in, self.mixer_out_l),
+                ("mixer_gain", self.mixer_in, self.mixer_out_r)]
+
+    def on_device_change(self, event):
+        if event.parameter[0] == "mixer_source":
+            self.set_combo_src(self.combo_src, self.combo_src_handler,
+                               event.new)
+            return
+        gain_l = self.device.state.get(("mixer_gain", self.mixer_in,
+                                        self.mixer_out_l))
+        gain_r = self.device.state.get(("mixer_gain", self.mixer_in,
+                                        self.mixer_out_r))
+        if gain_l is None or gain_r is None:
+            return
+        # invert the constant power pan law of send_pan()
+        amp_l = 0.0 if gain_l <= -128 else 10**(gain_l/20.0)
+        amp_r = 0.0 if gain_r <= -128 else 10**(gain_r/20.0)
+        amp = math.hypot(amp_l, amp_r)
+        if amp > 0:
+            self.gain = min(max(20*math.log10(amp), -128), 6)
+            self.pan = 4*math.atan2(amp_r, amp_l)/math.pi - 1
+        else:
+            self.gain = -128
+        self.gain_fader.set_value(self.gain)
+        self.pan_scale.set_value(100*self.pan)
+
+    def send_pan(self):
+        with self.device.change_origin(self):
+            self.device.set_mixer_pan(self.mixer_in, self.mixer_out_l,
+                                      self.mixer_out_r, self.pan, self.gain)
+
+    def on_pan_changed(self, gtk_range, scroll_type, value):
+        self.pan = min(max(value, -100), 100)/100.0
+        with scarlett_latency.gesture(self.device, "mixer_pan"):
+            self.send_pan()
+        return False  # False = further process signal (e.g., fader animation)
+
+    def on_gain_changed(self, gtk_range, scroll_type, value):
+        self.gain = value
+        with scarlett_latency.gesture(self.device, "mixer_gain"):
+            self.send_pan()
+        return False  # False = further process signal (e.g., fader animation)
+
+
+# _____________________________________________________________________________
+
+
+class LinkedStereoMixerStrip(StereoMixerStrip):
+    """A stereo pair of inputs in a stereo pair of mixes, with balance."""
+
+    def __init__(self, device, mixer_out_l, mixer_out_r, mixer_in_l,
+                 mixer_in_r):
+        self.mixer_in_r = mixer_in_r
+        StereoMixerStrip.__init__(self, device, mixer_out_l, mixer_out_r,
+                                  mixer_in_l)
+        self.set_label("%s/%s" % (mixer_in_l, mixer_in_r))
+
+        # source of the right input
+        self.combo_src_r, self.combo_src_r_handler = self.new_combo_src(
+            self.on_combo_src_r_changed)
+        self.vbox.pack_start(self.combo_src_r, False, False, 0)
+        self.vbox.reorder_child(self.combo_src_r, 1)
+
+    def on_combo_src_r_changed(self, combo):
+        mixer_src = combo.get_active_text()
+        if mixer_src is not None:
+            with scarlett_latency.gesture(self.device, "mixer_source"), \
+                    self.device.change_origin(self):
+                self.device.set_mixer_source(mixer_src, self.mixer_in_r)
+
+    def parameters(self):
+        return [("mixer_source", self.mixer_in),
+                ("mixer_source", self.mixer_in_r),
+                ("mixer_gain", self.mixer_in, self.mixer_out_l),
+                ("mixer_gain", self.mixer_in_r, self.mixer_out_r)]
+
+    def on_device_change(self, event):
+        if event.parameter == ("mixer_source", self.mixer_in):
+            self.set_combo_src(self.combo_src, self.combo_src_handler,
+                               event.new)
+            return
+        if event.parameter == ("mixer_source", self.mixer_in_r):
+            self.set_combo_src(self.combo_src_r, self.combo_src_r_handler,
+                               event.new)
+            return
+        gain_l = self.device.state.get(("mixer_gain", self.mixer_in,
+                                        self.mixer_out_l))
+        gain_r = self.device.state.get(("mixer_gain", self.mixer_in_r,
+                                        self.mixer_out_r))
+        if gain_l is None or gain_r is None:
+            return
+        # invert the balance law of send_pan(): the louder side is at gain
+        self.gain = max(gain_l, gain_r)
+        if self.gain > -128:
+            if gain_l >= gain_r:
+                self.pan = 10**((gain_r - gain_l)/20.0) - 1
+            else:
+                self.pan = 1 - 10**((gain_l - gain_r)/20.0)
+        self.gain_fader.set_value(self.gain)
+        self.pan_scale.set_value(100*self.pan)
+
+    def send_pan(self):
+        with self.device.change_origin(self):
+            self.device.set_stereo_gain(self.mixer_in, self.mixer_in_r,
+                                        self.mixer_out_l, self.mixer_out_r,
+                                        self.gain, self.pan)
+
+    def update_level(self, levels):
+        # show the louder side of the pair
+        mixer_src = self.combo_src.get_active_text() or "OFF"
+        mixer_src_r = self.combo_src_r.get_active_text() or "OFF"
+        self.level_bar.set_value(
+            max(source_level(self.device.config, levels, mixer_src),
+                source_level(self.device.config, levels, mixer_src_r)))
+
+
+# _____________________________________________________________________________
+
+
+class StereoMixerPanel(Gtk.Bin):
+
+    def __init__(self, device, mixer_out_l, mixer_out_r):
+        Gtk.Bin.__init__(self)
+
+        self.device = device
+        self.mixer_out_l = mixer_out_l
+        self.mixer_out_r = mixer_out_r
+
+        # mono inputs, panned
+        self.mono_hbox = Gtk.HBox()
+        self.mono_strips = list()
+        for strip in range(18):
+            mixer_in = "CH_%02d" % (strip+1)
+            ms = StereoMixerStrip(self.device, mixer_out_l, mixer_out_r,
+                                  mixer_in)
+            self.mono_strips.append(ms)
+            self.mono_hbox.pack_start(ms, False, False, 0)
+
+        # linked pairs of inputs (CH_01/CH_02, ...), with balance
+        self.linked_hbox = Gtk.HBox()
+        self.linked_strips = list()
+        for strip in range(0, 18, 2):
+            ms = LinkedStereoMixerStrip(self.device, mixer_out_l,
+                                        mixer_out_r, "CH_%02d" % (strip+1),
+                                        "CH_%02d" % (strip+2))
+            self.linked_strips.append(ms)
+            self.linked_hbox.pack_start(ms, False, False, 0)
+
+        self.mixer_strip_list = self.mono_strips  # visible strips
+        self.all_strips = self.mono_strips + self.linked_strips
+
+        self.stack = Gtk.Stack()
+        self.stack.add_named(self.mono_hbox, "mono")
+        self.stack.add_named(self.linked_hbox, "linked")
+        self.link_button = Gtk.ToggleButton.new_with_label("Link inputs")
+        self.link_button.connect("toggled", self.on_link_toggled)
+
+        self.vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+        self.vbox.pack_start(self.link_button, False, False, 5)
+        self.vbox.pack_start(self.stack, True, True, 0)
+        self.add(self.vbox)
+
+    def on_link_toggled(self, button):
+        if button.get_active():
+            self.stack.set_visible_child_name("linked")
+            self.mixer_strip_list = self.linked_strips
+        else:
+            self.stack.set_visible_child_name("mono")
+            self.mixer_strip_list = self.mono_strips
+
+# _____________________________________________________________________________
+
+
+class MonitorPanel(Gtk.Bin):
+
+    def __init__(self, device):
+        Gtk.Bin.__init__(self)
+
+        self.device = device
+        self.controller = scarlett_monitor.MonitorController(device)
+
+        # cut and dim switches; mono needs a reserved mix and known gains of
+        # the monitor mixes (see scarlett_monitor), so it is not offered here
+        switch_hbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
+        self.cut_button = Gtk.ToggleButton.new_with_label("CUT")
+        self.cut_handler = self.cut_button.connect("toggled",
+                                                   self.on_cut_toggled)
+        self.dim_button = Gtk.ToggleButton.new_with_label(
+            "DIM (%g dB)" % self.controller.dim_gain)
+        self.dim_handler = self.dim_button.connect("toggled",
+                                                   self.on_dim_toggled)
+        for button in [self.cut_button, self.dim_button]:
+            switch_hbox.pack_start(button, False, False, 5)
+        switch_frame = Gtk.Frame.new("Monitor")
+        switch_frame.add(switch_hbox)
+
+        # speaker set selection
+        speaker_hbox = Gtk.Box.new(Gtk.Orientation.HORIZONTAL, 0)
+        group = None
+        for name in self.controller.speaker_sets:
+            radio = Gtk.RadioButton.new_with_label_from_widget(group, name)
+            radio.connect("toggled", self.on_speakers_toggled, name)
+            speaker_hbox.pack_start(radio, False, False, 5)
+            group = radio
+        speaker_frame = Gtk.Frame.new("Speakers")
+        speaker_frame.add(speaker_hbox)
+
+        self.vbox = Gtk.Box.new(Gtk.Orientation.VERTICAL, 0)
+        self.vbox.pack_start(switch_frame, False, False, 5)
+        self.vbox.pack_start(speaker_frame, False, False, 5)
+        self.add(self.vbox)
+
+    def revert_button(self, button, handler_id, active):
+        button.handler_block(handler_id)
+        button.set_active(active)
+        button.handler_unblock(handler_id)
+
+    def on_cut_toggled(self, button):
+        try:
+            with scarlett_latency.gesture(self.device, "monitor_cut"), \
+                    self.device.change_origin(self):
+                self.controller.set_cut(button.get_active())
+        except ValueError:
+            self.revert_button(button, self.cut_handler, self.controller.cut)
+
+    def on_dim_toggled(self, button):
+        try:
+            with scarlett_latency.gesture(self.device, "monitor_dim"), \
+                    self.device.change_origin(self):
+                self.controller.set_dim(button.get_active())
+        except ValueError:
+            # e.g. output gains not set since the device was opened
+            self.revert_button(button, self.dim_handler,
+                               self.controller.dimmed)
+
+    def on_speakers_toggled(self, button, name):
+        if button.get_active():
+            with scarlett_latency.gesture(self.device, "monitor_speakers"), \
+                    self.device.change_origin(self):
+                self.controller.select_speakers(name)
+
+
+# _____________________________________________________________________________
+
+
+parser = argparse.ArgumentParser(description="Mixer GUI for Focusrite "
+                                             "Scarlett devices.")
+parser.add_argument("--trace-latency", action="store_true",
+                    help="trace control latencies; dump them on exit")
+parser.add_argument("--meters", action="store_true",
+                    help="show peak meters of the mixer inputs")
+parser.add_argument("--meter-process", action="store_true",
+                    help="read peak meters in a separate worker process "
+                         "(implies --meters)")
+args = parser.parse_args()
+
+w = RedBeetWindow(trace_latency=args.trace_latency, meters=args.meters,
+                  meter_process=args.meter_process)
 w.connect("delete-event", Gtk.main_quit)
 w.show_all()
 Gtk.main()
+
+if w.meters is not None:
+    w.meters.stop()
+
+if w.device.latency is not None:
+    w.device.latency.dump(sys.stderr)
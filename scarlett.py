@@ -13,11 +13,19 @@ Copyright (C) 2013 Robin Gareus <robin@gareus.org>
 License: GPL3 [http://www.gnu.org/licenses/gpl.html]
 """
 
+import collections
+import contextlib
+import heapq
+import itertools
 import json
 import math
 import struct
+import threading
+import time
 import usb.core
 import usb.util
+import scarlett_pipeline
+import scarlett_trace
 
 
 # constants for auto-detecting interfaces by usb product id
@@ -29,6 +37,19 @@ ID_18I8 = 0x8014
 ID_18I20 = 0x800c
 
 
+# dictionary with pointers to json files that contain device-specific
+# configuration data
+# TODO: later files should be in /usr/share/package-foo/mapping/
+# TODO: create 18i20 json file
+MAPPING_FILE_BY_ID = {
+    ID_6I6:   "mapping/scarlett_6i6_mapping.json",
+    ID_8I6:   "mapping/scarlett_8i6_mapping.json",
+    ID_18I6:  "mapping/scarlett_18i6_mapping.json",
+    ID_18I8:  "mapping/scarlett_18i8_mapping.json",
+    ID_18I20: "mapping/scarlett_18i20_mapping_TODO.json"
+}
+
+
 # constants for set_impedance()
 IMPEDANCE_LINE = 0x00
 IMPEDANCE_INST = 0x01
@@ -44,15 +65,90 @@ UNMUTE = 0x00
 MUTE = 0x01
 
 
-def _mixer_gain_to_hex(gain):
-    """Calculate little endian byte sequence for matrix mixer element gain.
+# constants for set_mixer_pan() and set_stereo_gain()
+PAN_LAW_0DB = 0    # balance law; 0 dB at center, opposite side attenuated
+PAN_LAW_3DB = 1    # constant power (sin/cos); -3 dB at center
+PAN_LAW_4_5DB = 2  # compromise between constant power and linear
+PAN_LAW_6DB = 3    # linear amplitude; -6 dB at center
+
+# number of pan positions from hard left (-1) to hard right (+1)
+PAN_STEPS = 201
+
+
+# effective range of raw matrix mixer gains (1/256 dB); RAW_GAIN_MIN is
+# silence
+RAW_GAIN_MIN = -128*256
+RAW_GAIN_MAX = 6*256
+
+
+# constants for transfer priorities; lower values are served first
+PRIORITY_PANIC = 0
+PRIORITY_CONTROL = 1
+PRIORITY_AUTOMATION = 2
+PRIORITY_METER = 3
+
+
+# default USB timeouts in ms per transfer priority
+DEFAULT_TIMEOUTS = {
+    PRIORITY_PANIC: 200,
+    PRIORITY_CONTROL: 500,
+    PRIORITY_AUTOMATION: 1000,
+    PRIORITY_METER: 100
+}
+
+
+# default deadlines in s per transfer priority; transfers that cannot be
+# started within their deadline are dropped (None = wait indefinitely)
+DEFAULT_DEADLINES = {
+    PRIORITY_PANIC: None,
+    PRIORITY_CONTROL: None,
+    PRIORITY_AUTOMATION: None,
+    PRIORITY_METER: 0.05
+}
+
+
+# monotonic clock where available (Python 3), wall clock otherwise
+_now = getattr(time, 'monotonic', time.time)
+
+
+# change event of a device parameter; see ScarlettDevice.subscribe()
+ChangeEvent = collections.namedtuple('ChangeEvent',
+                                     'parameter old new origin')
+
+
+class TransferExpiredError(ValueError):
+    """A USB control transfer was dropped because its deadline passed."""
+    pass
+
+
+class BatchTransferError(ValueError):
+    """A USB control transfer of a batch failed.
+
+    Attributes:
+        sent (list): One bool per item of the batch; True if the transfer was
+            sent successfully, False if it failed or was not sent. BARRIER
+            items are False.
+
+    """
+
+    def __init__(self, message, sent):
+        ValueError.__init__(self, message)
+        self.sent = sent
+
+
+def _to_bytearray(data):
+    """Convert a list of (signed or unsigned) byte values to a bytearray."""
+    return bytearray(value & 0xff for value in data)
+
+
+def _mixer_gain_to_raw(gain):
+    """Calculate the integer representation of a matrix mixer element gain.
 
     Args:
         gain (float): Gain in dB; effective range [-128 .. 6].
 
     Returns:
-        Little endian two-byte sequence of the gain's int representation;
-        for use in USB control commands.
+        Gain as int in units of 1/256 dB; range [-32768 .. 1536].
 
     """
     if gain < -128:
@@ -60,9 +156,57 @@ def _mixer_gain_to_hex(gain):
     elif gain > 6:
         gain = 6
     # A 1dB step in gain equals a step of 256 in the integer representation.
+    return int(round(gain*256.0))
+
+
+def _raw_to_hex(raw):
+    """Calculate little endian byte sequence for an integer gain.
+
+    Args:
+        raw (int): Gain in units of 1/256 dB; range [-32768 .. 32767].
+
+    Returns:
+        Little endian two-byte sequence of the integer; for use in USB
+        control commands.
+
+    """
     # Pack integer as signed short, unpack as two signed bytes (lsb, msb).
-    byte_seq = list(struct.unpack('2b', struct.pack('1h', round(gain*256.0))))
-    return byte_seq
+    return list(struct.unpack('2b', struct.pack('1h', raw)))
+
+
+def _mixer_gain_to_hex(gain):
+    """Calculate little endian byte sequence for matrix mixer element gain.
+
+    Args:
+        gain (float): Gain in dB; effective range [-128 .. 6].
+
+    Returns:
+        Little endian two-byte sequence of the gain's int representation;
+        for use in USB control commands.
+
+    """
+    return _raw_to_hex(_mixer_gain_to_raw(gain))
+
+
+def _hex_to_gain(byte_seq):
+    """Calculate the gain in dB from a little endian two-byte sequence."""
+    return struct.unpack('1h', struct.pack('2b', *byte_seq))[0]/256.0
+
+
+def _mixer_element_index(mix_in_index, mix_out_index):
+    """Calculate the element index of a matrix mixer element.
+
+    Args:
+        mix_in_index, mix_out_index (int): Indices of the matrix mixer input
+            and output as defined in self.config["mixer_in"] and
+            self.config["mixer_out"] of a ScarlettDevice.
+
+    Returns:
+        Index of the element; the wValue of the set-gain request is 0x0100
+        plus this index.
+
+    """
+    return (mix_in_index << 3) + (mix_out_index & 0x07)
 
 
 def _postroute_gain_to_hex(gain):
@@ -86,6 +230,94 @@ def _postroute_gain_to_hex(gain):
     return byte_seq
 
 
+def _pan_amplitudes(law, pan):
+    """Calculate left and right linear amplitudes for a pan position.
+
+    Args:
+        law (int): Enum-like int value defined in the scarlett module; must
+            be one of the PAN_LAW_* constants.
+        pan (float): Pan position; range [-1 (left) .. 1 (right)].
+
+    Returns:
+        Tuple of the left and right amplitude; range [0 .. 1].
+
+    """
+    pos = (pan + 1)/2.0  # [0 .. 1]
+    theta = pos*math.pi/2
+    if law == PAN_LAW_0DB:
+        return min(1.0, 2*(1 - pos)), min(1.0, 2*pos)
+    elif law == PAN_LAW_3DB:
+        return math.cos(theta), math.sin(theta)
+    elif law == PAN_LAW_4_5DB:
+        return (math.sqrt(max(0.0, math.cos(theta))*(1 - pos)),
+                math.sqrt(math.sin(theta)*pos))
+    elif law == PAN_LAW_6DB:
+        return 1 - pos, pos
+    raise ValueError('Invalid pan law')
+
+
+def _amplitude_to_raw(amplitude):
+    """Calculate the integer representation (1/256 dB) of an amplitude."""
+    if amplitude <= 0:
+        return _mixer_gain_to_raw(-128)
+    return _mixer_gain_to_raw(20*math.log10(amplitude))
+
+
+def _build_pan_table(law):
+    """Precompute left/right gains for all PAN_STEPS pan positions.
+
+    Returns:
+        List of (raw_l, raw_r, hex_l, hex_r) tuples, i.e. the gains in 1/256
+        dB and their encoding for USB control commands (see
+        _mixer_gain_to_hex()).
+
+    """
+    table = list()
+    for step in range(PAN_STEPS):
+        pan = 2.0*step/(PAN_STEPS - 1) - 1
+        amp_l, amp_r = _pan_amplitudes(law, pan)
+        raw_l = _amplitude_to_raw(amp_l)
+        raw_r = _amplitude_to_raw(amp_r)
+        table.append((raw_l, raw_r, _raw_to_hex(raw_l), _raw_to_hex(raw_r)))
+    return table
+
+
+_PAN_TABLES = dict((law, _build_pan_table(law))
+                   for law in [PAN_LAW_0DB, PAN_LAW_3DB, PAN_LAW_4_5DB,
+                               PAN_LAW_6DB])
+
+
+def _pan_gains_to_hex(law, pan, gain):
+    """Look up the encoded left/right element gains for a pan position.
+
+    Args:
+        law (int): One of the PAN_LAW_* constants.
+        pan (float): Pan position; range [-1 (left) .. 1 (right)].
+        gain (float): Gain in dB that is added to both sides.
+
+    Returns:
+        Tuple of the little endian two-byte sequences of the left and right
+        gain; for use in USB control commands.
+
+    """
+    if law not in _PAN_TABLES:
+        raise ValueError('Invalid pan law')
+    pan = min(max(pan, -1), 1)
+    step = int(round((pan + 1)*(PAN_STEPS - 1)/2.0))
+    raw_l, raw_r, hex_l, hex_r = _PAN_TABLES[law][step]
+    if gain == 0:
+        return hex_l, hex_r
+    # add the gain in the integer domain; silent sides stay silent
+    raw_gain = _mixer_gain_to_raw(gain)
+    if raw_l > RAW_GAIN_MIN:
+        hex_l = _raw_to_hex(min(max(raw_l + raw_gain, RAW_GAIN_MIN),
+                                RAW_GAIN_MAX))
+    if raw_r > RAW_GAIN_MIN:
+        hex_r = _raw_to_hex(min(max(raw_r + raw_gain, RAW_GAIN_MIN),
+                                RAW_GAIN_MAX))
+    return hex_l, hex_r
+
+
 def _twobyte_to_db(lsb, msb):
     """Calculate peak level in dB from a two-byte sequence.
 
@@ -138,6 +370,101 @@ def get_device_name(device):
     name = "%s %s (S/N: %s)" % (mfr, prod, ser)
     return name
 
+
+def find_device(serial=None):
+    """Find a connected Scarlett device by its serial number.
+
+    Args:
+        serial (string): Serial number of the device. The default value is
+            None, which picks the first device of get_device_list().
+
+    Returns:
+        The pyusb device object, or None if no matching device is connected.
+
+    """
+    for device in get_device_list():
+        if (serial is None or
+                usb.util.get_string(device, device.iSerialNumber) == serial):
+            return device
+    return None
+
+# _____________________________________________________________________________
+
+
+class TransferScheduler(object):
+    """Serialize USB control transfers of concurrent callers by priority.
+
+    A Scarlett device has a single control endpoint. The scheduler decides
+    which caller may use it next; the transfer itself is then issued from the
+    caller's own thread. Waiting callers are served by priority (lowest value
+    first) and, within one priority, in order of arrival. A caller whose
+    deadline passes while waiting is dropped with TransferExpiredError. The
+    current holder of the endpoint may acquire it again (e.g., a batch of
+    transfers that calls single transfers).
+
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = list()  # heap of (priority, sequence number)
+        self._sequence = itertools.count()
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self, priority, expiry=None):
+        """Wait until the control endpoint is granted to the caller.
+
+        Args:
+            priority (int): Transfer priority, e.g. PRIORITY_CONTROL.
+            expiry (float): Time (on the clock of _now()) after which the
+                caller gives up waiting. The default value is None, which
+                waits indefinitely.
+
+        Raises:
+            TransferExpiredError: An error occurred when the endpoint could
+                not be granted before expiry.
+
+        """
+        caller = threading.current_thread()
+        with self._cond:
+            if self._owner is caller:
+                self._depth += 1
+                return
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if expiry is not None and _now() >= expiry:
+                        raise TransferExpiredError(
+                            'USB control transfer expired')
+                    if self._owner is None and self._waiting[0] == entry:
+                        break
+                    if expiry is None:
+                        self._cond.wait()
+                    else:
+                        self._cond.wait(expiry - _now())
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._owner = caller
+            self._depth = 1
+
+    def release(self):
+        """Give the control endpoint back to the next waiting caller."""
+        with self._cond:
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def has_waiting(self, priority):
+        """Return True if a caller with a more urgent priority is waiting."""
+        with self._cond:
+            return bool(self._waiting) and self._waiting[0][0] < priority
+
 # _____________________________________________________________________________
 
 
@@ -151,7 +478,7 @@ class ScarlettDevice(object):
 
     """
 
-    def __init__(self, device=None):
+    def __init__(self, device=None, trace=None, latency=None):
         """Construct a new ScarlettDevice instance.
 
         Args:
@@ -159,6 +486,24 @@ class ScarlettDevice(object):
                 instance. The default value is None, which triggers the auto-
                 detection. Auto-detection gathers a list of all valid Scarlett
                 devices attached to USB and picks the first item of the list.
+                Any object with a pyusb-compatible ctrl_transfer() method and
+                an idProduct attribute can be used in place of a usb object,
+                e.g. scarlett_meter.RemoteDevice.
+            trace (scarlett_trace.TraceWriter): Recorder to which every USB
+                control transfer is written. The default value is None, which
+                disables recording; see also start_trace().
+            latency (scarlett_latency.LatencyTracer): Tracer to which the
+                timing of every USB control transfer is reported. The default
+                value is None, which disables latency tracing.
+
+        All USB control transfers are serialized by a TransferScheduler. The
+        USB timeout (in ms) and the deadline (in s) of a transfer depend on
+        its priority and can be configured per instance through the
+        dictionaries self.timeouts and self.deadlines. Batches of transfers
+        are pipelined where possible, see enable_pipelining().
+
+        The last value set for every parameter is kept in self.state; changes
+        are reported to subscribers as ChangeEvents, see subscribe().
 
         Raises:
             ValueError: An error occured when auto-detect does not find any
@@ -168,6 +513,16 @@ class ScarlettDevice(object):
             devices by productid or serial number.
         """
         self.device = device
+        self.trace = trace
+        self.latency = latency
+        self.pipeline = None
+        self.scheduler = TransferScheduler()
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.deadlines = dict(DEFAULT_DEADLINES)
+        self._local = threading.local()
+        self.state = dict()
+        self._subscribers = list()
+        self._change_lock = threading.Lock()
 
         # auto-detect (default: first found device)
         if self.device is None:
@@ -180,34 +535,31 @@ class ScarlettDevice(object):
         # before accessing the device, detach kernel drivers
         # store list of previously attached interfaces
         self.previously_attached = list()
-        for interface in range(6):
-            if self.device.is_kernel_driver_active(interface):
-                self.previously_attached.append(interface)
-                self.device.detach_kernel_driver(interface)
-
-        # set bConfigurationValue=1
-        self.device.set_configuration(1)
-
-        # claim device interface 0 (control)
-        usb.util.claim_interface(self.device, 0)
-
-        # dictionary with pointers to json files that contain device-specific
-        # configuration data
-        # TODO: later files should be in /usr/share/package-foo/mapping/
-        # TODO: create 18i20 json file
-        json_file_by_id = {
-            ID_6I6:   "mapping/scarlett_6i6_mapping.json",
-            ID_8I6:   "mapping/scarlett_8i6_mapping.json",
-            ID_18I6:  "mapping/scarlett_18i6_mapping.json",
-            ID_18I8:  "mapping/scarlett_18i8_mapping.json",
-            ID_18I20: "mapping/scarlett_18i20_mapping_TODO.json"
-        }
+        # stand-ins for pyusb devices (e.g. scarlett_meter.RemoteDevice) only
+        # need ctrl_transfer(); the device behind them is set up elsewhere
+        if isinstance(self.device, usb.core.Device):
+            for interface in range(6):
+                if self.device.is_kernel_driver_active(interface):
+                    self.previously_attached.append(interface)
+                    self.device.detach_kernel_driver(interface)
+
+            # set bConfigurationValue=1
+            self.device.set_configuration(1)
+
+            # claim device interface 0 (control)
+            usb.util.claim_interface(self.device, 0)
+
+            # send batches through the libusb asynchronous API if available
+            self.enable_pipelining()
+
         # load json into dictionary with device configuration
-        self.config = json.load(open(json_file_by_id[self.device.idProduct]))
+        mapping_file = MAPPING_FILE_BY_ID[self.device.idProduct]
+        self.config = json.load(open(mapping_file))
 
     def __del__(self):
+        self.stop_trace()
         # self.device might be None, e.g. when auto-detect failed
-        if self.device:
+        if isinstance(self.device, usb.core.Device):
             # release claimed interface; only then kernel can be re-attached
             usb.util.release_interface(self.device, 0)
 
@@ -224,6 +576,133 @@ class ScarlettDevice(object):
         """Get the name and serial number of the Scarlett device."""
         return get_device_name(self.device)
 
+    def start_trace(self, filename):
+        """Start recording all USB control transfers into a trace file.
+
+        Args:
+            filename (string): Path of the binary trace file; an existing file
+                is overwritten. See the scarlett_trace module for the format
+                and for replaying traces.
+
+        """
+        self.stop_trace()
+        self.trace = scarlett_trace.TraceWriter(open(filename, 'wb'), _now())
+
+    def stop_trace(self):
+        """Stop recording USB control transfers; close the trace file."""
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    # ____ change notification ________________________________________________
+
+    # Every setter reports the values it has sent as ChangeEvents. The
+    # parameter of an event is a tuple of the setter's name without "set_"
+    # and its names, values are given as passed to the setter:
+    #
+    # parameter                              value
+    # ('impedance', channel)                 IMPEDANCE_LINE or IMPEDANCE_INST
+    # ('pad', channel)                       PAD_ON or PAD_OFF
+    # ('clock_source',)                      name of the clock source
+    # ('sampling_rate',)                     rate in Hz
+    # ('mixer_source', mix_in)               name of the source
+    # ('mixer_gain', mix_in, mix_out)        gain in dB (in steps of 1/256 dB)
+    # ('route', dest)                        name of the router source
+    # ('postroute_mute', bus)                MUTE or UNMUTE
+    # ('postroute_gain', bus)                gain in dB (in steps of 1/256 dB)
+
+    def subscribe(self, callback):
+        """Register a function that is called when parameters change.
+
+        The function is called with a list of ChangeEvents (parameter, old
+        value, new value, origin) from the thread that made the changes, once
+        per setter call or once per change_batch(). Within a list, every
+        parameter occurs at most once; parameters that were set to their
+        previous value are left out. The old value is None if the parameter
+        has not been set before.
+
+        """
+        with self._change_lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a function registered with subscribe()."""
+        with self._change_lock:
+            self._subscribers.remove(callback)
+
+    @contextlib.contextmanager
+    def change_batch(self):
+        """Context manager that emits all changes made within it at once.
+
+        Batches of the current thread can be nested; the events are emitted
+        when the outermost batch ends, even if it ends with an exception.
+
+        """
+        if getattr(self._local, 'changes', None) is not None:
+            yield
+            return
+        self._local.changes = list()
+        try:
+            yield
+        finally:
+            events = self._local.changes
+            self._local.changes = None
+            self._emit_changes(events)
+
+    @contextlib.contextmanager
+    def change_origin(self, origin):
+        """Context manager that sets the origin of all changes.
+
+        The setting applies only to changes made from the current thread; a
+        GUI widget, for example, passes itself as origin in order to ignore
+        the events of its own edits. The default origin is None.
+
+        """
+        previous = getattr(self._local, 'origin', None)
+        self._local.origin = origin
+        try:
+            yield
+        finally:
+            self._local.origin = previous
+
+    def notify_change(self, parameter, value):
+        """Store the new value of a parameter and report it if it changed.
+
+        Called by all setters after a successful transfer. Call it directly
+        for changes that bypass the setters, e.g. a restored configuration.
+
+        Args:
+            parameter (tuple): Parameter; see the table above.
+            value: New value of the parameter.
+
+        """
+        with self._change_lock:
+            old = self.state.get(parameter)
+            if parameter in self.state and old == value:
+                return
+            self.state[parameter] = value
+        event = ChangeEvent(parameter, old, value,
+                            getattr(self._local, 'origin', None))
+        if getattr(self._local, 'changes', None) is not None:
+            self._local.changes.append(event)
+        else:
+            self._emit_changes([event])
+
+    def _emit_changes(self, events):
+        """Merge events per parameter and pass them to all subscribers."""
+        merged = collections.OrderedDict()
+        for event in events:
+            if event.parameter in merged:
+                event = event._replace(old=merged[event.parameter].old)
+            merged[event.parameter] = event
+        events = [event for event in merged.values() if event.old != event.new]
+        if not events:
+            return
+        with self._change_lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(events)
+
     # -------------------------------------------------------------------------
     # USB control transfers
     # -------------------------------------------------------------------------
@@ -262,20 +741,258 @@ class ScarlettDevice(object):
     #      0x03  0x0003  0x3c00   Get peak meters of daw channels
     #                             (len = 2 bytes x number of daw channels)
 
-    def usb_ctrl_send(self, bm_request, w_value, w_index, data):
+    @contextlib.contextmanager
+    def transfer_priority(self, priority):
+        """Context manager that sets the default priority of all transfers.
+
+        The setting applies only to transfers issued from the current thread,
+        e.g. an automation thread wraps its calls in
+        "with sdev.transfer_priority(scarlett.PRIORITY_AUTOMATION):".
+
+        """
+        previous = self._get_priority(None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _get_priority(self, priority):
+        """Resolve priority None to the current thread's default."""
+        if priority is None:
+            return getattr(self._local, 'priority', PRIORITY_CONTROL)
+        return priority
+
+    def ctrl_transfer(self, request_type, bm_request, w_value=0, w_index=0,
+                      data_or_length=None, timeout=None, priority=None,
+                      deadline=None):
+        """Issue a USB control transfer; record it if tracing is enabled.
+
+        The first six arguments mirror usb.core.Device.ctrl_transfer(), so
+        that a ScarlettDevice can be used wherever a pyusb device is
+        expected, e.g. as target of scarlett_trace.replay_trace().
+
+        Args:
+            timeout (int): USB timeout in ms. The default value is None,
+                which uses self.timeouts[priority].
+            priority (int): Transfer priority, e.g. PRIORITY_METER. The
+                default value is None, which uses the current thread's
+                default (see transfer_priority()).
+            deadline (float): Time in s after which the transfer is dropped
+                if it could not be started. The default value is None, which
+                uses self.deadlines[priority].
+
+        Raises:
+            TransferExpiredError: An error occurred when the transfer was
+                dropped because its deadline passed.
+
+        """
+        priority = self._get_priority(priority)
+        if timeout is None:
+            timeout = self.timeouts.get(priority)
+        if deadline is None:
+            deadline = self.deadlines.get(priority)
+        submitted = _now()
+        expiry = None if deadline is None else submitted + deadline
+        self.scheduler.acquire(priority, expiry)
+        try:
+            start = _now()
+            result = None
+            try:
+                result = self.device.ctrl_transfer(
+                    request_type, bm_request, w_value, w_index,
+                    data_or_length, timeout=timeout)
+                return result
+            finally:
+                self._record_transfer(request_type, bm_request, w_value,
+                                      w_index, data_or_length, submitted,
+                                      start, _now(), result)
+        finally:
+            self.scheduler.release()
+
+    def _record_transfer(self, request_type, bm_request, w_value, w_index,
+                         data_or_length, submitted, start, completed,
+                         result):
+        """Report a completed transfer to the trace and latency tracers."""
+        if self.trace is not None:
+            self.trace.record(request_type, bm_request, w_value, w_index,
+                              data_or_length, start, completed - start,
+                              result)
+        if self.latency is not None:
+            self.latency.record_transfer(submitted, start, completed)
+
+    def enable_pipelining(self, window=8):
+        """Send batches of transfers through the libusb asynchronous API.
+
+        With pipelining, usb_ctrl_send_batch() keeps up to window transfers in
+        flight instead of waiting for each transfer to complete. See the
+        scarlett_pipeline module for details. Pipelining is enabled when a
+        pyusb device is opened; call this method to change the window.
+
+        Args:
+            window (int): Maximum number of transfers in flight. The default
+                value is 8.
+
+        Returns:
+            True if pipelining is enabled; False if the asynchronous API is
+            not available, in which case batches are sent synchronously.
+
+        """
+        try:
+            self.pipeline = scarlett_pipeline.PipelinedTransferEngine(
+                self.device, window)
+        except NotImplementedError:
+            self.pipeline = None
+        return self.pipeline is not None
+
+    def disable_pipelining(self):
+        """Send batches of transfers synchronously, one at a time."""
+        self.pipeline = None
+
+    def usb_ctrl_send(self, bm_request, w_value, w_index, data,
+                      priority=None, deadline=None):
         """Issue a send-type (host-to-device) USB control transfer."""
         try:
-            assert self.device.ctrl_transfer(0x21, bm_request, w_value,
-                                             w_index, data) == len(data)
+            assert self.ctrl_transfer(0x21, bm_request, w_value, w_index,
+                                      data, priority=priority,
+                                      deadline=deadline) == len(data)
+        except TransferExpiredError:
+            raise
         except:
             raise ValueError('USB control transfer failed')
 
-    def usb_ctrl_recv(self, bm_request, w_value, w_index, data):
+    def usb_ctrl_send_batch(self, transfers, priority=None):
+        """Issue a batch of send-type USB control transfers in one pass.
+
+        The control endpoint is held for the whole batch, so that transfers of
+        the same or lower priority cannot interleave. Callers with a more
+        urgent priority (e.g. a panic mute) are let through between two
+        transfers of the batch (or, with pipelining enabled, as soon as the
+        transfers in flight have completed).
+
+        Args:
+            transfers: Iterable of (bm_request, w_value, w_index, data)
+                tuples; see usb_ctrl_send(). Items may also be
+                scarlett_pipeline.BARRIER, see there.
+            priority (int): Priority of all transfers of the batch. The
+                default value is None, which uses the current thread's
+                default (see transfer_priority()).
+
+        Raises:
+            BatchTransferError: An error occurred when a USB control transfer
+                failed; its attribute sent tells which transfers were sent.
+                Without pipelining, the batch stops at the failed transfer.
+                With pipelining, the transfers up to the next BARRIER have
+                been sent nonetheless, but none after it.
+
+        """
+        priority = self._get_priority(priority)
+        transfers = list(transfers)
+        if self.pipeline is not None:
+            self._usb_ctrl_send_pipelined(transfers, priority)
+            return
+        sent = list()
+        self._acquire_batch(priority)
+        try:
+            for transfer in transfers:
+                if transfer is scarlett_pipeline.BARRIER:
+                    sent.append(False)
+                    continue
+                if self.scheduler.has_waiting(priority):
+                    self.scheduler.release()
+                    self._acquire_batch(priority)
+                bm_request, w_value, w_index, data = transfer
+                try:
+                    self.usb_ctrl_send(bm_request, w_value, w_index, data,
+                                       priority)
+                except ValueError:
+                    sent += [False] * (len(transfers) - len(sent))
+                    raise BatchTransferError('USB control transfer failed',
+                                             sent)
+                sent.append(True)
+        finally:
+            self.scheduler.release()
+
+    def _acquire_batch(self, priority):
+        """Acquire the control endpoint for a batch; trace the wait."""
+        submitted = _now()
+        self.scheduler.acquire(priority)
+        if self.latency is not None:
+            self.latency.record_wait(submitted, _now())
+
+    def _usb_ctrl_send_pipelined(self, transfers, priority):
+        """Issue a batch through self.pipeline; see usb_ctrl_send_batch()."""
+        timeout = self.timeouts.get(priority)
+        batch = [transfer if transfer is scarlett_pipeline.BARRIER
+                 else (0x21,) + tuple(transfer) + (timeout,)
+                 for transfer in transfers]
+
+        # the wait for the endpoint is traced by _acquire_batch()
+        def on_complete(pos, start, completed, result):
+            request_type, bm_request, w_value, w_index, data, _ = batch[pos]
+            self._record_transfer(request_type, bm_request, w_value, w_index,
+                                  data, start, start, completed, result)
+
+        def should_yield():
+            return self.scheduler.has_waiting(priority)
+
+        def yield_now():
+            self.scheduler.release()
+            self._acquire_batch(priority)
+
+        self._acquire_batch(priority)
+        try:
+            results = self.pipeline.run(batch, on_complete, should_yield,
+                                        yield_now)
+        finally:
+            self.scheduler.release()
+        sent = [transfer is not scarlett_pipeline.BARRIER and
+                result == len(transfer[4])
+                for transfer, result in zip(batch, results)]
+        if sent.count(True) != len(batch) - batch.count(
+                scarlett_pipeline.BARRIER):
+            raise BatchTransferError('USB control transfer failed', sent)
+
+    def _send_changes(self, transfers, changes, priority=None):
+        """Send a batch, then report the changes of the transfers sent.
+
+        Args:
+            transfers: See usb_ctrl_send_batch().
+            changes: One (parameter, value) pair per item of transfers; None
+                for BARRIER items.
+            priority (int): See usb_ctrl_send_batch().
+
+        Raises:
+            BatchTransferError: An error occurred when a USB control transfer
+                failed. The changes of the transfers that were sent have been
+                reported nonetheless.
+
+        """
+        failure = None
+        try:
+            self.usb_ctrl_send_batch(transfers, priority)
+            sent = [change is not None for change in changes]
+        except BatchTransferError as err:
+            failure = err
+            sent = err.sent
+        with self.change_batch():
+            for change, was_sent in zip(changes, sent):
+                if was_sent:
+                    self.notify_change(*change)
+        if failure is not None:
+            raise failure
+
+    def usb_ctrl_recv(self, bm_request, w_value, w_index, data,
+                      priority=None, deadline=None):
         "Issue a receive-type (device-to-host) USB control transfer."""
         try:
-            received_data = self.device.ctrl_transfer(0xa1, bm_request,
-                                                      w_value, w_index, data)
+            received_data = self.ctrl_transfer(0xa1, bm_request, w_value,
+                                               w_index, data,
+                                               priority=priority,
+                                               deadline=deadline)
             return received_data
+        except TransferExpiredError:
+            raise
         except:
             raise ValueError('USB control transfer failed')
 
@@ -308,6 +1025,7 @@ class ScarlettDevice(object):
             0x0100,
             [impedance, 0x00]
         )
+        self.notify_change(('impedance', channel), impedance)
 
     def set_pad(self, channel, pad_onoff):
         """Set pad (attenuation) of analog hardware inputs.
@@ -335,6 +1053,7 @@ class ScarlettDevice(object):
             0x0100,
             [pad_onoff, 0x00]
         )
+        self.notify_change(('pad', channel), pad_onoff)
 
     def set_clock_source(self, src):
         """Set the hardware clock source.
@@ -356,6 +1075,7 @@ class ScarlettDevice(object):
             0x2800,
             [self.config["clk_switch"][src]]
         )
+        self.notify_change(('clock_source',), src)
 
     def set_sampling_rate(self, rate):
         """Set sampling rate.
@@ -373,6 +1093,7 @@ class ScarlettDevice(object):
         # pack rate in int, unpack as 4-byte tuple, then convert to list.
         rate_seq = list(struct.unpack('4b', struct.pack('i', rate)))
         self.usb_ctrl_send(0x01, 0x0100, 0x2900, rate_seq)
+        self.notify_change(('sampling_rate',), rate)
 
     def save_settings_to_hardware(self):
         """Save configuration to device; restored after power-cycles."""
@@ -380,22 +1101,21 @@ class ScarlettDevice(object):
 
     def zero_settings(self):
         """Disconnect all inputs and outputs; set all gains to 0 dB."""
-
-        # disconnect all matrix mixer inputs; set all matrix mixer elements to
-        # unity gain (0 dB).
-        for mixer_in in self.device.config["mixer_in"]:
-            self.set_mixer_source("OFF", mixer_in)
-            for mixer_out in self.device.config["mixer_out"]:
-                self.set_mixer_gain(mixer_in, mixer_out, 0)
-
-        # disconnect all router inputs
-        for dest in self.device.config["router_dest"]:
-            self.route_mix("OFF", dest)
-
-        # unmute and set all master buses to unity gain (0 dB)
-        for bus in self.device.config["signal_out"]:
-            self.set_postroute_mute(bus, UNMUTE)
-            self.set_postroute_gain(bus, 0)
+        # disconnect all matrix mixer inputs and router destinations first
+        settings = [(('mixer_source', mixer_in), "OFF")
+                    for mixer_in in self.config["mixer_in"]]
+        settings += [(('route', dest), "OFF")
+                     for dest in self.config["router_dest"]]
+        # only then set all matrix mixer elements to unity gain (0 dB) and
+        # unmute all master buses at unity gain (0 dB)
+        settings.append(scarlett_pipeline.BARRIER)
+        settings += [(('mixer_gain', mixer_in, mixer_out), 0)
+                     for mixer_in in self.config["mixer_in"]
+                     for mixer_out in self.config["mixer_out"]]
+        for bus in self.config["signal_out"]:
+            settings.append((('postroute_mute', bus), UNMUTE))
+            settings.append((('postroute_gain', bus), 0))
+        self.apply_settings(settings)
 
     # ____ mixer stage ________________________________________________________
 
@@ -415,16 +1135,9 @@ class ScarlettDevice(object):
                 sources or matrix mixer inputs.
 
         """
-        if src not in self.config["mixer_src"]:
-            raise KeyError('Invalid signal source')
-        if mix_in not in self.config["mixer_in"]:
-            raise KeyError('Invalid matrix mixer input')
-        self.usb_ctrl_send(
-            0x01,
-            0x0600 + self.config["mixer_in"][mix_in],
-            0x3200,
-            [self.config["mixer_src"][src], 0x00]
-        )
+        self.usb_ctrl_send(*self._setting_transfer(('mixer_source', mix_in),
+                                                   src))
+        self.notify_change(('mixer_source', mix_in), src)
 
     def set_mixer_gain(self, mix_in, mix_out, gain=0):
         """Set the gain of a matrix mixer element.
@@ -446,14 +1159,129 @@ class ScarlettDevice(object):
             raise KeyError('Invalid matrix mixer input')
         if mix_out not in self.config["mixer_out"]:
             raise KeyError('Invalid mixer output')
-        element_index = ((self.config["mixer_in"][mix_in] << 3) +
-                         (self.config["mixer_out"][mix_out] & 0x07))
+        element_index = _mixer_element_index(self.config["mixer_in"][mix_in],
+                                             self.config["mixer_out"][mix_out])
         self.usb_ctrl_send(
             0x01,
             0x0100 + element_index,
             0x3c00,
             _mixer_gain_to_hex(gain)
         )
+        self.notify_change(('mixer_gain', mix_in, mix_out),
+                           _mixer_gain_to_raw(gain)/256.0)
+
+    def set_mixer_gain_batch(self, elements):
+        """Set the gains of several matrix mixer elements in one pass.
+
+        Args:
+            elements: Iterable of (mix_in, mix_out, gain) tuples; see
+                set_mixer_gain() for the meaning of the values.
+
+        Raises:
+            KeyError: An error occurred when trying to access invalid matrix
+                mixer input or output. In this case, nothing is sent.
+            BatchTransferError: An error occurred when a USB control transfer
+                failed; see usb_ctrl_send_batch().
+
+        """
+        elements = list(elements)
+        transfers = [(0x01, self._mixer_element_value(mix_in, mix_out), 0x3c00,
+                      _mixer_gain_to_hex(gain))
+                     for mix_in, mix_out, gain in elements]
+        self._send_changes(transfers,
+                           [(('mixer_gain', mix_in, mix_out),
+                             _mixer_gain_to_raw(gain)/256.0)
+                            for mix_in, mix_out, gain in elements])
+
+    def _mixer_element_value(self, mix_in, mix_out):
+        """Get the wValue of the set-gain request of a mixer element."""
+        if mix_in not in self.config["mixer_in"]:
+            raise KeyError('Invalid matrix mixer input')
+        if mix_out not in self.config["mixer_out"]:
+            raise KeyError('Invalid mixer output')
+        return 0x0100 + _mixer_element_index(self.config["mixer_in"][mix_in],
+                                             self.config["mixer_out"][mix_out])
+
+    def set_mixer_pan(self, mix_in, mix_out_l, mix_out_r, pan=0.0, gain=0,
+                      law=PAN_LAW_3DB):
+        """Pan a mono matrix mixer input into a stereo pair of mixes.
+
+        The gains of the two matrix mixer elements (mix_in, mix_out_l) and
+        (mix_in, mix_out_r) are looked up in a precomputed table of the pan
+        law and sent back to back.
+
+        Args:
+            mix_in (string): Name of the matrix mixer input; must be defined in
+                the device dictionary self.config["mixer_in"].
+            mix_out_l, mix_out_r (string): Names of the left and right matrix
+                mixer outputs; must be defined in the device dictionary
+                self.config["mixer_out"].
+            pan (float): Pan position; range [-1 (left) .. 1 (right)],
+                quantized to PAN_STEPS positions. The default value is 0
+                (center).
+            gain (float): Gain in dB that is added to both elements. The
+                default value is 0 dB.
+            law (int): Enum-like int value defined in the scarlett module; must
+                be one of the PAN_LAW_* constants. The default value is
+                PAN_LAW_3DB.
+
+        Raises:
+            KeyError: An error occurred when trying to access invalid matrix
+                mixer input or outputs.
+            ValueError: An error occurred when trying to use an invalid pan
+                law.
+
+        """
+        w_value_l = self._mixer_element_value(mix_in, mix_out_l)
+        w_value_r = self._mixer_element_value(mix_in, mix_out_r)
+        hex_l, hex_r = _pan_gains_to_hex(law, pan, gain)
+        self._send_changes([(0x01, w_value_l, 0x3c00, hex_l),
+                            (0x01, w_value_r, 0x3c00, hex_r)],
+                           [(('mixer_gain', mix_in, mix_out_l),
+                             _hex_to_gain(hex_l)),
+                            (('mixer_gain', mix_in, mix_out_r),
+                             _hex_to_gain(hex_r))])
+
+    def set_stereo_gain(self, mix_in_l, mix_in_r, mix_out_l, mix_out_r,
+                        gain=0, balance=0.0, law=PAN_LAW_0DB):
+        """Set gain and balance of a stereo pair of matrix mixer inputs.
+
+        The left input is sent to the left mix and the right input to the
+        right mix; the gains of both elements are looked up in a precomputed
+        table of the pan law and sent back to back. The cross elements
+        (left input to right mix and vice versa) are not changed.
+
+        Args:
+            mix_in_l, mix_in_r (string): Names of the left and right matrix
+                mixer inputs; must be defined in the device dictionary
+                self.config["mixer_in"].
+            mix_out_l, mix_out_r (string): Names of the left and right matrix
+                mixer outputs; must be defined in the device dictionary
+                self.config["mixer_out"].
+            gain (float): Gain in dB of both elements. The default value is
+                0 dB.
+            balance (float): Balance; range [-1 (left) .. 1 (right)]. The
+                default value is 0 (center).
+            law (int): Enum-like int value defined in the scarlett module; must
+                be one of the PAN_LAW_* constants. The default value is
+                PAN_LAW_0DB, which leaves both sides at full gain at center.
+
+        Raises:
+            KeyError: An error occurred when trying to access invalid matrix
+                mixer inputs or outputs.
+            ValueError: An error occurred when trying to use an invalid pan
+                law.
+
+        """
+        w_value_l = self._mixer_element_value(mix_in_l, mix_out_l)
+        w_value_r = self._mixer_element_value(mix_in_r, mix_out_r)
+        hex_l, hex_r = _pan_gains_to_hex(law, balance, gain)
+        self._send_changes([(0x01, w_value_l, 0x3c00, hex_l),
+                            (0x01, w_value_r, 0x3c00, hex_r)],
+                           [(('mixer_gain', mix_in_l, mix_out_l),
+                             _hex_to_gain(hex_l)),
+                            (('mixer_gain', mix_in_r, mix_out_r),
+                             _hex_to_gain(hex_r))])
 
     # ____ routing stage ______________________________________________________
 
@@ -474,16 +1302,8 @@ class ScarlettDevice(object):
                 sources or destinations.
 
         """
-        if src not in self.config["router_src"]:
-            raise KeyError('Invalid router source')
-        if dest not in self.config["router_dest"]:
-            raise KeyError('Invalid router destination')
-        self.usb_ctrl_send(
-            0x01,
-            self.config["router_dest"][dest],
-            0x3300,
-            [self.config["router_src"][src], 0x00]
-        )
+        self.usb_ctrl_send(*self._setting_transfer(('route', dest), src))
+        self.notify_change(('route', dest), src)
 
     # ____ post-routing stage _________________________________________________
 
@@ -500,15 +1320,14 @@ class ScarlettDevice(object):
             KeyError: An error occurred when trying to access an invalid output
                 bus.
 
+        Muting is sent with PRIORITY_PANIC, i.e. ahead of all other pending
+        transfers.
+
         """
-        if bus not in self.config["signal_out"]:
-            raise KeyError('Invalid output bus')
-        self.usb_ctrl_send(
-            0x01,
-            0x0100 + self.config["signal_out"][bus],
-            0x0a00,
-            [mute, 0x00]
-        )
+        self.usb_ctrl_send(*self._setting_transfer(('postroute_mute', bus),
+                                                   mute),
+                           priority=PRIORITY_PANIC if mute == MUTE else None)
+        self.notify_change(('postroute_mute', bus), mute)
 
     def set_postroute_gain(self, bus, gain):
         """Set the gain of an output bus in the post-routing stage.
@@ -525,13 +1344,111 @@ class ScarlettDevice(object):
                 bus.
 
         """
-        if bus not in self.config["signal_out"]:
-            raise KeyError('Invalid output bus')
-        self.usb_ctrl_send(
-            0x01,
-            0x0200 + self.config["signal_out"][bus],
-            0x0a00, _postroute_gain_to_hex(gain)
-        )
+        transfer = self._setting_transfer(('postroute_gain', bus), gain)
+        self.usb_ctrl_send(*transfer)
+        self.notify_change(('postroute_gain', bus), _hex_to_gain(transfer[3]))
+
+    # ____ settings batches ___________________________________________________
+
+    def _setting_transfer(self, parameter, value):
+        """Get the USB control transfer that sets a parameter.
+
+        Args:
+            parameter (tuple): One of the 'mixer_source', 'mixer_gain',
+                'route', 'postroute_mute', or 'postroute_gain' parameters of
+                the change notification table.
+            value: New value of the parameter, as passed to the setter.
+
+        Returns:
+            Tuple (bm_request, w_value, w_index, data); see usb_ctrl_send().
+
+        Raises:
+            KeyError: An error occurred when trying to access an invalid
+                parameter or invalid names.
+
+        """
+        kind = parameter[0]
+        if kind == 'mixer_source':
+            if value not in self.config["mixer_src"]:
+                raise KeyError('Invalid signal source')
+            if parameter[1] not in self.config["mixer_in"]:
+                raise KeyError('Invalid matrix mixer input')
+            return (0x01, 0x0600 + self.config["mixer_in"][parameter[1]],
+                    0x3200, [self.config["mixer_src"][value], 0x00])
+        elif kind == 'mixer_gain':
+            return (0x01, self._mixer_element_value(parameter[1],
+                                                    parameter[2]),
+                    0x3c00, _mixer_gain_to_hex(value))
+        elif kind == 'route':
+            if value not in self.config["router_src"]:
+                raise KeyError('Invalid router source')
+            if parameter[1] not in self.config["router_dest"]:
+                raise KeyError('Invalid router destination')
+            return (0x01, self.config["router_dest"][parameter[1]], 0x3300,
+                    [self.config["router_src"][value], 0x00])
+        elif kind in ('postroute_mute', 'postroute_gain'):
+            if parameter[1] not in self.config["signal_out"]:
+                raise KeyError('Invalid output bus')
+            if kind == 'postroute_mute':
+                return (0x01, 0x0100 + self.config["signal_out"][parameter[1]],
+                        0x0a00, [value, 0x00])
+            return (0x01, 0x0200 + self.config["signal_out"][parameter[1]],
+                    0x0a00, _postroute_gain_to_hex(value))
+        raise KeyError('Invalid parameter')
+
+    def encode_settings(self, settings):
+        """Encode settings into a batch of USB control transfers.
+
+        The result can be stored and passed to apply_settings() any number of
+        times, so that time-critical batches are encoded only once.
+
+        Args:
+            settings: Iterable of (parameter, value) pairs; see
+                _setting_transfer() for the supported parameters. Items may
+                also be scarlett_pipeline.BARRIER, see there.
+
+        Returns:
+            List of (bm_request, w_value, w_index, data) tuples (and
+            BARRIER items).
+
+        Raises:
+            KeyError: An error occurred when trying to access an invalid
+                parameter or invalid names. In this case, nothing is sent.
+
+        """
+        return [setting if setting is scarlett_pipeline.BARRIER
+                else self._setting_transfer(*setting)
+                for setting in settings]
+
+    def apply_settings(self, settings, transfers=None, priority=None):
+        """Send several settings as one batch and report their changes.
+
+        Args:
+            settings: List of (parameter, value) pairs; see encode_settings().
+            transfers: Result of encode_settings(settings). The default value
+                is None, which encodes the settings now.
+            priority (int): Priority of the batch; see usb_ctrl_send_batch().
+
+        Raises:
+            KeyError: An error occurred when trying to access an invalid
+                parameter or invalid names. In this case, nothing is sent.
+            BatchTransferError: An error occurred when a USB control transfer
+                failed; see usb_ctrl_send_batch(). The changes of the settings
+                that were sent have been reported nonetheless.
+
+        """
+        if transfers is None:
+            transfers = self.encode_settings(settings)
+        changes = list()
+        for setting, transfer in zip(settings, transfers):
+            if setting is scarlett_pipeline.BARRIER:
+                changes.append(None)
+                continue
+            parameter, value = setting
+            if parameter[0] in ('mixer_gain', 'postroute_gain'):
+                value = _hex_to_gain(transfer[3])  # as sent
+            changes.append((parameter, value))
+        self._send_changes(transfers, changes, priority)
 
     # ____ peak meters ________________________________________________________
 
@@ -542,15 +1459,24 @@ class ScarlettDevice(object):
             Dictionary of peak meter levels in dB for all {'input', 'daw',
             and 'mix'} channels.
 
+        Raises:
+            TransferExpiredError: An error occurred when one of the meter reads
+                was dropped because other transfers occupied the device past
+                the PRIORITY_METER deadline. The caller should simply poll
+                again later.
+
         """
 
         # TODO: this only holds for the 18i8 -- should be put in self.config[]
         num_inp_ch = 18
         num_daw_ch = 8
         num_mix_ch = 8
-        inp_data = self.usb_ctrl_recv(0x03, 0x0000, 0x3c00, 2*num_inp_ch)
-        daw_data = self.usb_ctrl_recv(0x03, 0x0003, 0x3c00, 2*num_daw_ch)
-        mix_data = self.usb_ctrl_recv(0x03, 0x0001, 0x3c00, 2*num_mix_ch)
+        inp_data = self.usb_ctrl_recv(0x03, 0x0000, 0x3c00, 2*num_inp_ch,
+                                      PRIORITY_METER)
+        daw_data = self.usb_ctrl_recv(0x03, 0x0003, 0x3c00, 2*num_daw_ch,
+                                      PRIORITY_METER)
+        mix_data = self.usb_ctrl_recv(0x03, 0x0001, 0x3c00, 2*num_mix_ch,
+                                      PRIORITY_METER)
 
         inp_db = list()
         daw_db = list()
@@ -0,0 +1,245 @@
+"""An asyncio interface to Focusrite Scarlett devices (Python 3.6+).
+
+This module contains the AsyncScarlettDevice class, which offers awaitable
+versions of the setters and meter reads of ScarlettDevice. All calls are
+executed by a single I/O thread that the instance owns, so that any number of
+coroutines (and other threads) can share one device. Pending calls are
+served by transfer priority (see scarlett.PRIORITY_*), then in order of
+arrival; a panic mute is therefore not queued behind automation.
+
+The only exception are mutes (set_postroute_mute() with scarlett.MUTE): they
+are served by a second thread, so they do not wait for a long call that is
+already running (e.g. zero_settings()). Their transfers are arbitrated
+against the running call by the TransferScheduler of the device: they go out
+before its next transfer, or after the transfers in flight if it sends a
+pipelined batch. Unmuting is queued like any other call, so it cannot
+overtake e.g. a gain change that was submitted before it.
+
+Cancellation and timeouts: a call that is cancelled (or times out) before the
+I/O thread has started it is never sent. A call that is already running
+cannot be aborted; it completes in the background.
+
+Use with GTK: the I/O thread is independent of any event loop. An asyncio
+loop can run in a separate thread next to Gtk.main(), and GTK code can use
+the same instance through submit(), e.g.
+
+    future = adev.submit(adev.device.set_mixer_gain, "CH_01", "MIX1", -6)
+    future.add_done_callback(lambda f: GLib.idle_add(on_done, f))
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import queue
+import threading
+import time
+import scarlett
+
+
+def _wrap(name, default_priority=scarlett.PRIORITY_CONTROL):
+    """Create an awaitable method that calls ScarlettDevice.<name>()."""
+    async def method(self, *args, priority=None, timeout=None, **kwargs):
+        if priority is None:
+            priority = default_priority
+        return await self.call(getattr(self.device, name), *args,
+                               priority=priority, timeout=timeout, **kwargs)
+    method.__name__ = name
+    method.__doc__ = ("Awaitable version of ScarlettDevice.%s().\n\n"
+                      "Takes the additional keyword arguments priority and "
+                      "timeout; see call()." % name)
+    return method
+
+# _____________________________________________________________________________
+
+
+class AsyncScarlettDevice(object):
+    """Awaitable control of a ScarlettDevice through one owned I/O thread.
+
+    Example:
+        async with scarlett_asyncio.AsyncScarlettDevice() as adev:
+            await adev.set_mixer_gain("CH_01", "MIX1", -6)
+            async for timestamp, levels in adev.meters(0.05):
+                ...
+
+    """
+
+    def __init__(self, device=None):
+        """Construct a new AsyncScarlettDevice and start its threads.
+
+        Args:
+            device: A scarlett.ScarlettDevice to share (e.g. with a GUI) or a
+                usb object that is passed to scarlett.ScarlettDevice(). The
+                default value is None, which auto-detects the device.
+
+        Raises:
+            ValueError: An error occured when auto-detect does not find any
+                valid Scarlett device attached to USB.
+
+        """
+        if isinstance(device, scarlett.ScarlettDevice):
+            self.device = device
+        else:
+            self.device = scarlett.ScarlettDevice(device)
+        self._queue = queue.PriorityQueue()
+        self._mute_queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = list()
+        for name, calls in [("scarlett-io", self._queue),
+                            ("scarlett-io-mute", self._mute_queue)]:
+            thread = threading.Thread(target=self._run, args=(calls,),
+                                      name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self, calls):
+        """Main function of the threads; serves the queue calls."""
+        while True:
+            priority, _, future, func, args, kwargs = calls.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue  # cancelled while pending
+            try:
+                with self.device.transfer_priority(priority):
+                    result = func(*args, **kwargs)
+            except BaseException as err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
+
+    def submit(self, func, *args, priority=scarlett.PRIORITY_CONTROL,
+               **kwargs):
+        """Queue a call for the I/O thread.
+
+        Args:
+            func: Function to call, usually a method of self.device.
+            priority (int): Transfer priority of the call; it orders pending
+                calls and is the default priority of its USB transfers. The
+                default value is scarlett.PRIORITY_CONTROL.
+
+        Returns:
+            concurrent.futures.Future of the result.
+
+        """
+        return self._put(self._queue, priority, func, args, kwargs)
+
+    def _put(self, calls, priority, func, args, kwargs):
+        """Queue a call for the thread that serves calls."""
+        future = concurrent.futures.Future()
+        calls.put((priority, next(self._sequence), future, func, args,
+                   kwargs))
+        return future
+
+    async def call(self, func, *args, priority=scarlett.PRIORITY_CONTROL,
+                   timeout=None, **kwargs):
+        """Call a function in the I/O thread and await its result.
+
+        Args:
+            func: Function to call, usually a method of self.device.
+            priority (int): See submit().
+            timeout (float): Time in s after which the call is cancelled;
+                see the module docstring. The default value is None, which
+                waits indefinitely.
+
+        Raises:
+            asyncio.TimeoutError: An error occurred when the call did not
+                complete within timeout.
+
+        """
+        future = asyncio.wrap_future(self.submit(func, *args,
+                                                 priority=priority, **kwargs))
+        return await asyncio.wait_for(future, timeout)
+
+    def close(self):
+        """Complete all pending calls, then stop the threads."""
+        for calls in [self._queue, self._mute_queue]:
+            calls.put((float('inf'), next(self._sequence), None, None, None,
+                       None))
+        for thread in self._threads:
+            thread.join()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_event_loop().run_in_executor(None, self.close)
+
+    # ____ setters ____________________________________________________________
+
+    set_impedance = _wrap('set_impedance')
+    set_pad = _wrap('set_pad')
+    set_clock_source = _wrap('set_clock_source')
+    set_sampling_rate = _wrap('set_sampling_rate')
+    save_settings_to_hardware = _wrap('save_settings_to_hardware')
+    zero_settings = _wrap('zero_settings')
+    set_mixer_source = _wrap('set_mixer_source')
+    set_mixer_gain = _wrap('set_mixer_gain')
+    set_mixer_gain_batch = _wrap('set_mixer_gain_batch')
+    set_mixer_pan = _wrap('set_mixer_pan')
+    set_stereo_gain = _wrap('set_stereo_gain')
+    route_mix = _wrap('route_mix')
+    set_postroute_gain = _wrap('set_postroute_gain')
+    apply_settings = _wrap('apply_settings')
+
+    async def set_postroute_mute(self, bus, mute, priority=None,
+                                 timeout=None):
+        """Awaitable version of ScarlettDevice.set_postroute_mute().
+
+        Muting is sent with scarlett.PRIORITY_PANIC by the second thread; see
+        the module docstring. Unmuting is queued for the I/O thread.
+
+        Args:
+            priority (int): See submit(); applies to unmuting only. The
+                default value is None, which uses scarlett.PRIORITY_CONTROL.
+            timeout (float): See call().
+
+        """
+        if mute == scarlett.MUTE:
+            future = asyncio.wrap_future(self._put(
+                self._mute_queue, scarlett.PRIORITY_PANIC,
+                self.device.set_postroute_mute, (bus, mute), {}))
+            return await asyncio.wait_for(future, timeout)
+        if priority is None:
+            priority = scarlett.PRIORITY_CONTROL
+        return await self.call(self.device.set_postroute_mute, bus, mute,
+                               priority=priority, timeout=timeout)
+
+    # ____ peak meters ________________________________________________________
+
+    get_peak_meters = _wrap('get_peak_meters', scarlett.PRIORITY_METER)
+
+    async def meters(self, period=0.05):
+        """Async iterator of peak meter readings at a fixed period.
+
+        Readings that are dropped because other transfers occupied the
+        device past the PRIORITY_METER deadline are skipped; the iterator
+        does not try to catch up when it falls behind.
+
+        Args:
+            period (float): Interval between readings in s. The default value
+                is 0.05 (20 readings per second).
+
+        Yields:
+            Tuples of the timestamp (seconds since the epoch) and a dictionary
+            of peak meter levels as returned by
+            ScarlettDevice.get_peak_meters().
+
+        """
+        loop = asyncio.get_event_loop()
+        next_read = loop.time()
+        while True:
+            try:
+                levels = await self.get_peak_meters()
+            except scarlett.TransferExpiredError:
+                pass
+            else:
+                yield time.time(), levels
+            next_read += period
+            if next_read < loop.time():
+                next_read = loop.time() + period
+            await asyncio.sleep(next_read - loop.time())
@@ -0,0 +1,216 @@
+"""End-to-end latency tracing of control events of Scarlett devices.
+
+This module contains the LatencyTracer class, which measures the time from a
+control event in the GUI (e.g., a fader move) to the completion of the USB
+control transfers it causes. Each traced event (a "gesture") is split into
+the following stages:
+
+    dispatch  widget callback until the first USB transfer is submitted
+              (Python and library overhead)
+    queue     time spent waiting for the control endpoint (see
+              scarlett.TransferScheduler), including the wait of a batch
+    usb       time during which at least one USB control transfer was in
+              flight; overlapping (pipelined) transfers are counted once
+    total     widget callback until the last transfer is completed
+
+Tracing is attached to a device through ScarlettDevice.latency; widget
+callbacks wrap their work in gesture().
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import collections
+import contextlib
+import sys
+import threading
+import scarlett
+
+
+STAGES = ('dispatch', 'queue', 'usb', 'total')
+
+
+def _percentile(sorted_values, percent):
+    """Get the nearest-rank percentile of a sorted list."""
+    rank = int(round(percent/100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+def _union_length(intervals):
+    """Get the total length covered by a list of (start, end) intervals."""
+    length = 0.0
+    covered = None  # end of the intervals merged so far
+    for start, end in sorted(intervals):
+        if covered is None or start > covered:
+            length += end - start
+            covered = end
+        elif end > covered:
+            length += end - covered
+            covered = end
+    return length
+
+
+@contextlib.contextmanager
+def _no_trace():
+    """Context manager that does nothing; used when tracing is disabled."""
+    yield
+
+
+def gesture(device, kind):
+    """Trace a control event if latency tracing is enabled for a device.
+
+    Args:
+        device (scarlett.ScarlettDevice): Device the event is sent to.
+        kind (string): Type of control, e.g. "mixer_gain"; latencies are
+            reported per type.
+
+    Returns:
+        Context manager that wraps the handling of the event.
+
+    """
+    if device.latency is None:
+        return _no_trace()
+    return device.latency.gesture(kind)
+
+# _____________________________________________________________________________
+
+
+class LatencyTracer(object):
+    """Collect latencies of control events from GUI gesture to USB completion.
+
+    Gestures are tracked per thread: all USB transfers that are issued from
+    the thread of a gesture while it is active are attributed to it. Gestures
+    without any USB transfer are not recorded.
+
+    """
+
+    def __init__(self, max_samples=10000):
+        """Construct a new LatencyTracer instance.
+
+        Args:
+            max_samples (int): Number of most recent gestures kept per type of
+                control. The default value is 10000.
+
+        """
+        self.max_samples = max_samples
+        self.samples = dict()  # kind -> deque of (dispatch, queue, usb, total)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def gesture(self, kind):
+        """Context manager that traces one control event of type kind.
+
+        Nested gestures are attributed to the outermost one.
+
+        """
+        if getattr(self._local, 'event', None) is not None:
+            yield
+            return
+        event = {'start': scarlett._now(), 'submitted': None, 'queue': 0.0,
+                 'inflight': list(), 'completed': None}
+        self._local.event = event
+        try:
+            yield
+        finally:
+            self._local.event = None
+            if event['completed'] is not None:
+                sample = (event['submitted'] - event['start'], event['queue'],
+                          _union_length(event['inflight']),
+                          event['completed'] - event['start'])
+                with self._lock:
+                    if kind not in self.samples:
+                        self.samples[kind] = collections.deque(
+                            maxlen=self.max_samples)
+                    self.samples[kind].append(sample)
+
+    def record_wait(self, submitted, granted):
+        """Attribute a wait for the control endpoint to the current gesture.
+
+        Called by ScarlettDevice when a batch of transfers acquires the
+        endpoint, and for every control transfer (see record_transfer()).
+
+        Args:
+            submitted (float): Time at which the endpoint was requested.
+            granted (float): Time at which the control endpoint was granted.
+
+        """
+        event = getattr(self._local, 'event', None)
+        if event is None:
+            return
+        if event['submitted'] is None:
+            event['submitted'] = submitted
+        event['queue'] += granted - submitted
+
+    def record_transfer(self, submitted, granted, completed):
+        """Attribute a USB transfer to the current thread's gesture.
+
+        Called by ScarlettDevice for every control transfer.
+
+        Args:
+            submitted (float): Time at which the transfer was requested.
+            granted (float): Time at which the transfer was started, i.e.
+                the control endpoint was granted.
+            completed (float): Time at which the transfer was completed.
+
+        """
+        event = getattr(self._local, 'event', None)
+        if event is None:
+            return
+        self.record_wait(submitted, granted)
+        event['inflight'].append((granted, completed))
+        if event['completed'] is None or completed > event['completed']:
+            event['completed'] = completed
+
+    def clear(self):
+        """Discard all collected samples."""
+        with self._lock:
+            self.samples.clear()
+
+    def report(self):
+        """Get percentile latencies per type of control.
+
+        Returns:
+            Dictionary that maps each type of control to a dictionary that
+            maps each stage (see STAGES) to a dictionary with the keys 'p50',
+            'p90', 'p99', and 'max' (in ms) and 'count'.
+
+        """
+        with self._lock:
+            samples = dict((kind, list(values))
+                           for kind, values in self.samples.items())
+        report = dict()
+        for kind, values in samples.items():
+            report[kind] = dict()
+            for num, stage in enumerate(STAGES):
+                stage_values = sorted(1000*value[num] for value in values)
+                report[kind][stage] = {
+                    'count': len(stage_values),
+                    'p50': _percentile(stage_values, 50),
+                    'p90': _percentile(stage_values, 90),
+                    'p99': _percentile(stage_values, 99),
+                    'max': stage_values[-1]
+                }
+        return report
+
+    def summary(self):
+        """Get a one-line summary of p50/p99 total latencies per control."""
+        report = self.report()
+        return "  ".join("%s: %.1f/%.1f ms" % (kind,
+                                              report[kind]['total']['p50'],
+                                              report[kind]['total']['p99'])
+                         for kind in sorted(report))
+
+    def dump(self, fileobj=sys.stderr):
+        """Write a table of all percentile latencies to a file."""
+        report = self.report()
+        fileobj.write("%-16s %-9s %6s %8s %8s %8s %8s\n" %
+                      ("control", "stage", "count", "p50", "p90", "p99",
+                       "max"))
+        for kind in sorted(report):
+            for stage in STAGES:
+                stats = report[kind][stage]
+                fileobj.write("%-16s %-9s %6d %8.2f %8.2f %8.2f %8.2f\n" %
+                              (kind, stage, stats['count'], stats['p50'],
+                               stats['p90'], stats['p99'], stats['max']))
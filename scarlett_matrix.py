@@ -0,0 +1,242 @@
+"""An in-memory model of the matrix mixer of Focusrite Scarlett devices.
+
+This module contains the MixerMatrix class, which keeps the gains of all
+matrix mixer elements (mixer_in x mixer_out of the device mapping) in a
+compact array of raw integers in units of 1/256 dB, the same representation
+that the device uses. Bulk operations on the model compute the changed
+elements only and push them to the device in one batched pass.
+
+NumPy is optional; if it is installed, apply_array() and to_array() accept
+and return NumPy arrays.
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import array
+import math
+import scarlett
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class MixerMatrix(object):
+    """A model of the gain matrix of a Scarlett device's matrix mixer.
+
+    All operations that modify the model return a list of the elements that
+    actually changed as (mix_in, mix_out, gain) tuples, with gain in dB, and
+    push exactly these elements to the device. Elements are only updated in
+    the model after they were sent successfully.
+
+    Changes are determined against the values last sent to the device
+    (ScarlettDevice.state), so elements whose value on the device is unknown
+    are always sent. The model follows changes that are made through other
+    paths (e.g. ScarlettDevice.set_mixer_gain()) through the change
+    notification of the device; call close() to stop following them.
+
+    """
+
+    def __init__(self, device, gain=-128):
+        """Construct a new MixerMatrix instance.
+
+        Args:
+            device (scarlett.ScarlettDevice): Device whose matrix mixer is
+                modeled.
+            gain (float): Initial gain in dB of all elements that have not
+                been set on the device yet (see ScarlettDevice.state). The
+                default value is -128 dB (silence). The device itself is not
+                changed; call push_all() to bring it in line with the model.
+
+        """
+        self.device = device
+        self._in_index = device.config["mixer_in"]
+        self._out_index = device.config["mixer_out"]
+        self.num_in = max(self._in_index.values()) + 1
+        self.num_out = max(self._out_index.values()) + 1
+        self._in_names = dict((v, k) for k, v in self._in_index.items())
+        self._out_names = dict((v, k) for k, v in self._out_index.items())
+        raw = scarlett._mixer_gain_to_raw(gain)
+        self.raw = array.array('h', [raw] * (self.num_in * self.num_out))
+        for parameter, value in list(device.state.items()):
+            self._store(parameter, value)
+        device.subscribe(self._on_change)
+
+    def close(self):
+        """Stop following changes made through other paths."""
+        self.device.unsubscribe(self._on_change)
+
+    def _store(self, parameter, value):
+        """Store a parameter value of the device if it is a matrix element."""
+        if (parameter[0] == 'mixer_gain' and parameter[1] in self._in_index
+                and parameter[2] in self._out_index):
+            self.raw[self._offset(parameter[1], parameter[2])] = \
+                scarlett._mixer_gain_to_raw(value)
+
+    def _on_change(self, events):
+        """Apply changes of matrix mixer elements to the model."""
+        for event in events:
+            self._store(event.parameter, event.new)
+
+    def _offset(self, mix_in, mix_out):
+        """Get the position of an element in self.raw."""
+        if mix_in not in self._in_index:
+            raise KeyError('Invalid matrix mixer input')
+        if mix_out not in self._out_index:
+            raise KeyError('Invalid mixer output')
+        return self._in_index[mix_in]*self.num_out + self._out_index[mix_out]
+
+    def _column(self, mix_out):
+        """Get the positions of all elements of a mix in self.raw."""
+        if mix_out not in self._out_index:
+            raise KeyError('Invalid mixer output')
+        col = self._out_index[mix_out]
+        return range(col, len(self.raw), self.num_out)
+
+    def _row(self, mix_in):
+        """Get the positions of all elements of an input in self.raw."""
+        if mix_in not in self._in_index:
+            raise KeyError('Invalid matrix mixer input')
+        start = self._in_index[mix_in]*self.num_out
+        return range(start, start + self.num_out)
+
+    def _commit(self, updates):
+        """Push changed elements to the device and store them in the model.
+
+        Args:
+            updates: Iterable of (position, raw gain) pairs.
+
+        Returns:
+            List of (mix_in, mix_out, gain) tuples of the changed elements.
+
+        """
+        changed = dict()
+        for pos, raw in updates:
+            changed[pos] = min(max(raw, scarlett.RAW_GAIN_MIN),
+                               scarlett.RAW_GAIN_MAX)
+        elements = list()
+        for pos in sorted(changed):
+            row, col = divmod(pos, self.num_out)
+            mix_in, mix_out = self._in_names[row], self._out_names[col]
+            sent = self.device.state.get(('mixer_gain', mix_in, mix_out))
+            if sent == changed[pos]/256.0:
+                del changed[pos]
+                continue
+            elements.append((mix_in, mix_out, changed[pos]/256.0))
+        self.device.set_mixer_gain_batch(elements)
+        for pos in changed:
+            self.raw[pos] = changed[pos]
+        return elements
+
+    # ____ element access _____________________________________________________
+
+    def get(self, mix_in, mix_out):
+        """Get the gain of a matrix mixer element in dB."""
+        return self.raw[self._offset(mix_in, mix_out)]/256.0
+
+    def set(self, mix_in, mix_out, gain):
+        """Set the gain of a matrix mixer element in dB."""
+        return self._commit([(self._offset(mix_in, mix_out),
+                              scarlett._mixer_gain_to_raw(gain))])
+
+    def push_all(self):
+        """Send all elements of the model to the device.
+
+        Returns:
+            List of (mix_in, mix_out, gain) tuples of all elements.
+
+        """
+        elements = list()
+        for pos, raw in enumerate(self.raw):
+            row, col = divmod(pos, self.num_out)
+            elements.append((self._in_names[row], self._out_names[col],
+                             raw/256.0))
+        self.device.set_mixer_gain_batch(elements)
+        return elements
+
+    # ____ bulk operations ____________________________________________________
+
+    def offset_mix(self, mix_out, offset):
+        """Add a gain offset in dB to all elements of a mix.
+
+        Silent elements (at -128 dB) are left untouched, so that inputs that
+        are not part of the mix do not become audible.
+
+        """
+        delta = int(round(offset*256.0))
+        return self._commit((pos, self.raw[pos] + delta)
+                            for pos in self._column(mix_out)
+                            if self.raw[pos] > scarlett.RAW_GAIN_MIN)
+
+    def scale_mix(self, mix_out, factor):
+        """Scale the (linear) amplitude of all elements of a mix.
+
+        A factor of 0 or less silences the mix; see also offset_mix().
+
+        """
+        if factor <= 0:
+            return self.clear_mix(mix_out)
+        return self.offset_mix(mix_out, 20*math.log10(factor))
+
+    def copy_mix(self, src_out, dest_out):
+        """Copy all elements of mix src_out to mix dest_out."""
+        return self._commit(zip(self._column(dest_out),
+                                [self.raw[pos]
+                                 for pos in self._column(src_out)]))
+
+    def clear_mix(self, mix_out):
+        """Silence all elements of a mix (a column of the matrix)."""
+        return self._commit((pos, scarlett.RAW_GAIN_MIN)
+                            for pos in self._column(mix_out))
+
+    def clear_input(self, mix_in):
+        """Silence all elements of a mixer input (a row of the matrix)."""
+        return self._commit((pos, scarlett.RAW_GAIN_MIN)
+                            for pos in self._row(mix_in))
+
+    def swap_inputs(self, mix_in_a, mix_in_b):
+        """Swap the elements of two mixer inputs (rows of the matrix)."""
+        row_a = self._row(mix_in_a)
+        row_b = self._row(mix_in_b)
+        updates = [(pos, self.raw[other]) for pos, other in zip(row_a, row_b)]
+        updates += [(pos, self.raw[other]) for pos, other in zip(row_b, row_a)]
+        return self._commit(updates)
+
+    def apply_array(self, gains):
+        """Set all elements from a matrix of gains in dB.
+
+        Args:
+            gains: Nested sequence or NumPy array of shape (num_in, num_out);
+                rows and columns are ordered by the indices of
+                self.config["mixer_in"] and self.config["mixer_out"] of the
+                device.
+
+        Raises:
+            ValueError: An error occurred when gains has the wrong shape.
+
+        """
+        if numpy is not None:
+            gains = numpy.asarray(gains, dtype=float)
+            if gains.shape != (self.num_in, self.num_out):
+                raise ValueError('Invalid shape of gain matrix')
+            raw = numpy.clip(numpy.round(gains*256.0), scarlett.RAW_GAIN_MIN,
+                             scarlett.RAW_GAIN_MAX)
+            new = raw.astype(int).ravel().tolist()
+        else:
+            if (len(gains) != self.num_in or
+                    any(len(row) != self.num_out for row in gains)):
+                raise ValueError('Invalid shape of gain matrix')
+            new = [scarlett._mixer_gain_to_raw(gain)
+                   for row in gains for gain in row]
+        return self._commit(enumerate(new))
+
+    def to_array(self):
+        """Get all gains in dB as NumPy array (or as list of lists)."""
+        rows = [[raw/256.0 for raw in self.raw[start:start + self.num_out]]
+                for start in range(0, len(self.raw), self.num_out)]
+        if numpy is not None:
+            return numpy.array(rows)
+        return rows
@@ -0,0 +1,384 @@
+"""Out-of-process peak meter acquisition for Scarlett devices.
+
+This module contains the MeterProcess class, which runs the peak meter reads
+of a Scarlett device (ScarlettDevice.get_peak_meters()) in a separate worker
+process at a steady rate, unaffected by the GIL and the main loop of the GUI.
+The worker writes fixed-size frames into a shared-memory ring buffer
+(MeterRing); the GUI and any other consumer read the latest frame or a range
+of frames from it without locks.
+
+The control interface of a USB device can only be claimed by one process, so
+the worker process owns the device. Other transfers (e.g. the control writes
+of the GUI) are forwarded to the worker through a pipe: MeterProcess.device is
+a RemoteDevice that can be passed to ScarlettDevice in place of a pyusb
+device. The worker serves these transfers between two meter reads.
+
+Ring buffer layout (native byte order): a header with magic 'RBMR', number of
+slots, number of input, DAW, and mix meters (uint32 each), and the sequence
+number of the latest frame (uint64); followed by the slots. Each slot holds
+the sequence number of its frame (uint64, 0 while being written), a
+timestamp (double, seconds since the epoch), and the input, DAW, and mix
+levels in dB (float32 each). Frame n is stored in slot n % slots.
+
+Consumers that poll at a high rate can use MeterRing.read_view(), which
+returns the levels as views into the shared memory instead of copies (numpy
+arrays if numpy is installed, otherwise memoryviews on Python 3).
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+import threading
+import time
+import scarlett
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+RING_MAGIC = b'RBMR'
+
+_HEADER = struct.Struct('=4sIIIIQ')
+_SEQ_OFFSET = _HEADER.size - 8
+_SLOT_HEADER = struct.Struct('=Qd')
+
+
+class MeterRing(object):
+    """A shared-memory ring buffer of peak meter frames.
+
+    There is exactly one writer (the worker process); readers never block
+    the writer and never take locks. A reader checks the sequence number of a
+    slot before and after unpacking it and retries if the slot was
+    overwritten in between.
+
+    """
+
+    def __init__(self, path, create=False, slots=64, counts=(18, 8, 8)):
+        """Construct a new MeterRing instance.
+
+        Args:
+            path (string): Path of the file that backs the shared memory,
+                preferably on a tmpfs (e.g. /dev/shm).
+            create (bool): If True, the file is created (or truncated) and
+                initialized; only the writer does this. The default value is
+                False, which opens an existing ring.
+            slots (int): Number of frames kept in the ring (create only).
+            counts (tuple): Number of input, DAW, and mix meters (create
+                only).
+
+        Raises:
+            ValueError: An error occurred when the file is not a valid ring.
+
+        """
+        self.path = path
+        if create:
+            self.slots = slots
+            self.counts = tuple(counts)
+            size = self._size()
+            with open(path, 'wb') as fileobj:
+                fileobj.write(b'\0' * size)
+                fileobj.seek(0)
+                fileobj.write(_HEADER.pack(RING_MAGIC, slots, counts[0],
+                                           counts[1], counts[2], 0))
+        fileobj = open(path, 'r+b')
+        try:
+            header = fileobj.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError('Invalid meter ring')
+            magic, slots, num_inp, num_daw, num_mix, _ = _HEADER.unpack(header)
+            if magic != RING_MAGIC:
+                raise ValueError('Invalid meter ring')
+            self.slots = slots
+            self.counts = (num_inp, num_daw, num_mix)
+            self.buf = mmap.mmap(fileobj.fileno(), self._size())
+        finally:
+            fileobj.close()
+        self._levels = struct.Struct('=%df' % sum(self.counts))
+        self._slot_size = _SLOT_HEADER.size + self._levels.size
+
+    def _size(self):
+        """Get the size of the ring in bytes."""
+        levels_size = struct.calcsize('=%df' % sum(self.counts))
+        return _HEADER.size + self.slots*(_SLOT_HEADER.size + levels_size)
+
+    def _slot_offset(self, seq):
+        """Get the offset of the slot of frame seq."""
+        return _HEADER.size + (seq % self.slots)*self._slot_size
+
+    def close(self):
+        """Unmap the shared memory.
+
+        Views returned by read_view() must be released (deleted) first.
+
+        """
+        self.buf.close()
+
+    # ____ writer _____________________________________________________________
+
+    def write(self, levels, timestamp=None):
+        """Append a frame to the ring.
+
+        Args:
+            levels (dict): Peak meter levels as returned by
+                ScarlettDevice.get_peak_meters().
+            timestamp (float): Time of the reading in seconds since the epoch.
+                The default value is None, which uses the current time.
+
+        """
+        seq = self.latest_seq() + 1
+        offset = self._slot_offset(seq)
+        struct.pack_into('=Q', self.buf, offset, 0)  # invalidate slot
+        values = levels['input'] + levels['daw'] + levels['mix']
+        self._levels.pack_into(self.buf, offset + _SLOT_HEADER.size, *values)
+        struct.pack_into('=d', self.buf, offset + 8,
+                         time.time() if timestamp is None else timestamp)
+        struct.pack_into('=Q', self.buf, offset, seq)
+        struct.pack_into('=Q', self.buf, _SEQ_OFFSET, seq)
+
+    # ____ readers ____________________________________________________________
+
+    def latest_seq(self):
+        """Get the sequence number of the latest frame (0 = none yet)."""
+        return struct.unpack_from('=Q', self.buf, _SEQ_OFFSET)[0]
+
+    def read(self, seq):
+        """Read frame seq from the ring.
+
+        Returns:
+            Tuple of the timestamp and a dictionary of peak meter levels in dB
+            like ScarlettDevice.get_peak_meters(), or None if frame seq is not
+            (or no longer) in the ring.
+
+        """
+        if seq <= 0:
+            return None
+        offset = self._slot_offset(seq)
+        slot_seq, timestamp = _SLOT_HEADER.unpack_from(self.buf, offset)
+        if slot_seq != seq:
+            return None
+        values = self._levels.unpack_from(self.buf, offset + _SLOT_HEADER.size)
+        if struct.unpack_from('=Q', self.buf, offset)[0] != seq:
+            return None  # overwritten by the writer while unpacking
+        num_inp, num_daw, _ = self.counts
+        return timestamp, {
+            'input': list(values[:num_inp]),
+            'daw': list(values[num_inp:num_inp + num_daw]),
+            'mix': list(values[num_inp + num_daw:])
+        }
+
+    def read_view(self, seq):
+        """Get frame seq from the ring without copying its levels.
+
+        The levels are views into the slot of frame seq, which the writer
+        reuses for frame seq + self.slots. Consume them, then call
+        is_valid(seq) and discard the result if it returns False.
+
+        Returns:
+            Tuple of the timestamp and a dictionary of views of the peak
+            meter levels in dB (float32) with the keys of read(), or None if
+            frame seq is not (or no longer) in the ring. The views are numpy
+            arrays if numpy is available, otherwise memoryviews; without
+            either (Python 2 without numpy), the levels are copied as in
+            read().
+
+        """
+        if seq <= 0:
+            return None
+        offset = self._slot_offset(seq)
+        slot_seq, timestamp = _SLOT_HEADER.unpack_from(self.buf, offset)
+        if slot_seq != seq:
+            return None
+        offset += _SLOT_HEADER.size
+        count = sum(self.counts)
+        if numpy is not None:
+            values = numpy.frombuffer(self.buf, numpy.float32, count, offset)
+        elif hasattr(memoryview, 'cast'):
+            values = memoryview(self.buf)[offset:offset + 4*count].cast('f')
+        else:
+            values = self._levels.unpack_from(self.buf, offset)
+        if not self.is_valid(seq):
+            return None  # overwritten by the writer in between
+        num_inp, num_daw, _ = self.counts
+        return timestamp, {
+            'input': values[:num_inp],
+            'daw': values[num_inp:num_inp + num_daw],
+            'mix': values[num_inp + num_daw:]
+        }
+
+    def is_valid(self, seq):
+        """Check that frame seq is still in its slot; see read_view()."""
+        return struct.unpack_from('=Q', self.buf,
+                                  self._slot_offset(seq))[0] == seq
+
+    def latest(self):
+        """Read the latest frame; see read(). Returns None if there is none."""
+        return self.read(self.latest_seq())
+
+    def read_since(self, seq):
+        """Read all frames after frame seq that are still in the ring.
+
+        Returns:
+            List of (seq, timestamp, levels) tuples, oldest first.
+
+        """
+        latest = self.latest_seq()
+        frames = list()
+        for frame_seq in range(max(seq + 1, latest - self.slots + 1),
+                               latest + 1):
+            frame = self.read(frame_seq)
+            if frame is not None:
+                frames.append((frame_seq,) + frame)
+        return frames
+
+# _____________________________________________________________________________
+
+
+def _meter_worker_main(conn, path, serial, period, slots):
+    """Main function of the worker process; see MeterProcess."""
+    try:
+        device = scarlett.find_device(serial)
+        if device is None:
+            raise ValueError("No device found.")
+        sdev = scarlett.ScarlettDevice(device)
+        levels = sdev.get_peak_meters()
+        ring = MeterRing(path, True, slots, (len(levels['input']),
+                                             len(levels['daw']),
+                                             len(levels['mix'])))
+    except Exception as err:
+        conn.send(('error', str(err)))
+        return
+    conn.send(('ready', device.idProduct))
+
+    next_read = scarlett._now()
+    while True:
+        # serve forwarded transfers until the next meter read is due
+        if conn.poll(max(0.0, next_read - scarlett._now())):
+            request = conn.recv()
+            if request is None:
+                break
+            try:
+                result = sdev.device.ctrl_transfer(*request)
+                conn.send(('ok', result))
+            except Exception as err:
+                conn.send(('error', str(err)))
+            continue
+        try:
+            ring.write(sdev.get_peak_meters())
+        except ValueError:
+            pass  # dropped or failed read; the next one is due soon
+        next_read += period
+        if next_read < scarlett._now():  # fell behind; do not try to catch up
+            next_read = scarlett._now() + period
+    ring.close()
+
+
+class RemoteDevice(object):
+    """A stand-in for a pyusb device that lives in a MeterProcess worker.
+
+    Only ctrl_transfer() and idProduct are supported, which is all that
+    ScarlettDevice needs.
+
+    """
+
+    def __init__(self, conn, id_product):
+        self.idProduct = id_product
+        self._conn = conn
+        self._lock = threading.Lock()
+
+    def ctrl_transfer(self, request_type, bm_request, w_value=0, w_index=0,
+                      data_or_length=None, timeout=None):
+        """Issue a control transfer in the worker; mimics pyusb."""
+        if not isinstance(data_or_length, int):
+            data_or_length = list(data_or_length)
+        with self._lock:
+            self._conn.send((request_type, bm_request, w_value, w_index,
+                             data_or_length, timeout))
+            status, result = self._conn.recv()
+        if status != 'ok':
+            raise IOError(result)
+        return result
+
+    def close(self):
+        """Tell the worker process to release the device and exit."""
+        with self._lock:
+            self._conn.send(None)
+
+
+class MeterProcess(object):
+    """Run peak meter acquisition of a Scarlett device in a worker process.
+
+    Example:
+        meters = scarlett_meter.MeterProcess(period=0.02)
+        sdev = scarlett.ScarlettDevice(meters.device)
+        ...
+        frame = meters.ring.latest()
+
+    The device must not be opened by the calling process, since the worker
+    claims it.
+
+    """
+
+    def __init__(self, serial=None, period=0.02, path=None, slots=64):
+        """Start the worker process and wait until it is ready.
+
+        Args:
+            serial (string): Serial number of the device. The default value
+                is None, which picks the first device found.
+            period (float): Interval between meter reads in seconds. The
+                default value is 0.02 (50 frames per second).
+            path (string): File that backs the ring buffer. The default value
+                is None, which creates a file on /dev/shm (or in the default
+                temporary directory if /dev/shm does not exist).
+            slots (int): Number of frames kept in the ring. The default value
+                is 64.
+
+        Raises:
+            ValueError: An error occurred when the worker could not open the
+                device or exited before it was ready.
+
+        """
+        if path is None:
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            handle, path = tempfile.mkstemp(prefix='redbeet-meters-',
+                                            dir=shm_dir)
+            os.close(handle)
+        self.path = path
+        # the worker must not inherit libusb state; use spawn where available
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('spawn')
+        else:
+            context = multiprocessing
+        conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_meter_worker_main,
+            args=(child_conn, path, serial, period, slots))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()  # recv() fails instead of blocking once it exits
+        try:
+            while not conn.poll(0.1):
+                if not self.process.is_alive():
+                    raise EOFError
+            status, result = conn.recv()
+        except EOFError:
+            status, result = 'error', 'Meter worker process died.'
+        if status != 'ready':
+            self.process.join()
+            raise ValueError(result)
+        self.device = RemoteDevice(conn, result)
+        self.ring = MeterRing(path)
+
+    def stop(self):
+        """Stop the worker process and remove the ring buffer file."""
+        self.device.close()
+        self.process.join()
+        self.ring.close()
+        os.remove(self.path)
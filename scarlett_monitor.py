@@ -0,0 +1,280 @@
+"""A monitor controller section for Focusrite Scarlett devices.
+
+This module contains the MonitorController class, which offers the usual
+control-room operations on top of the post-routing stage and the router of a
+ScarlettDevice:
+
+    cut       mute all output buses (self.config["signal_out"])
+    dim       attenuate the monitored buses by a fixed amount
+    mono      sum the left and right monitor mixes at -6 dB each into a
+              mix of the matrix mixer that is reserved for this purpose
+              (mono_mix) and route it to both monitor destinations
+              (self.config["router_dest"])
+    speakers  switch between sets of output buses (e.g. A/B speakers) by
+              muting all buses of the other sets
+
+Every operation is sent as a single batch of USB control transfers with
+PRIORITY_PANIC, so that nothing is queued ahead of it. Batches that do not
+depend on the current settings (cut, speaker sets) are encoded once, when the
+controller is constructed. Engaging an operation captures the previous
+values of all parameters it changes from the device's state cache
+(ScarlettDevice.state); disengaging it restores them in one batch. The device
+cannot be queried, so operations that depend on a value that has not been set
+since the device was opened raise ValueError; cut is always possible, but
+buses with an unknown mute state stay muted when it is disengaged.
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import collections
+import scarlett
+import scarlett_pipeline
+
+
+def default_speaker_sets(config):
+    """Group the output buses of a device mapping into stereo speaker sets.
+
+    Args:
+        config (dict): Device mapping, e.g. ScarlettDevice.config.
+
+    Returns:
+        Ordered dictionary that maps names of speaker sets to lists of output
+        buses, e.g. {'MONITOR': ['MONITOR_L', 'MONITOR_R'], 'PHONES1': ...}.
+        The MASTER bus is not part of any set.
+
+    """
+    speaker_sets = collections.OrderedDict()
+    for bus in sorted(config["signal_out"], key=config["signal_out"].get):
+        if bus == 'MASTER':
+            continue
+        name = bus[:-2] if bus[-2:] in ('_L', '_R') else bus
+        speaker_sets.setdefault(name, list()).append(bus)
+    return speaker_sets
+
+# _____________________________________________________________________________
+
+
+class MonitorController(object):
+    """Cut, dim, mono, and speaker switching for a ScarlettDevice.
+
+    The operations can be combined; e.g. speakers can be switched while the
+    outputs are cut, in which case the new selection takes effect when cut is
+    disengaged.
+
+    """
+
+    def __init__(self, device, speaker_sets=None, dim_gain=-20.0,
+                 mono_dests=('MONITOR_L', 'MONITOR_R'), mono_mix=None):
+        """Construct a new MonitorController instance.
+
+        Args:
+            device (scarlett.ScarlettDevice): Device to control.
+            speaker_sets (dict): Names of speaker sets mapped to lists of
+                output buses. The default value is None, which uses
+                default_speaker_sets(device.config).
+            dim_gain (float): Attenuation of the monitored buses in dB while
+                dim is engaged. The default value is -20 dB.
+            mono_dests (tuple): Left and right router destination of the
+                monitor signal. The default value is ('MONITOR_L',
+                'MONITOR_R').
+            mono_mix (string): Matrix mixer output that is reserved for the
+                mono sum; it must not be used (nor routed) for anything else,
+                since mono overwrites its gains. The default value is None,
+                which disables mono.
+
+        Raises:
+            KeyError: An error occurred when speaker_sets, mono_dests, or
+                mono_mix contain names that are not in the device mapping.
+
+        """
+        self.device = device
+        if speaker_sets is None:
+            speaker_sets = default_speaker_sets(device.config)
+        self.speaker_sets = speaker_sets
+        self.dim_gain = dim_gain
+        self.mono_dests = tuple(mono_dests)
+        for dest in self.mono_dests:
+            if dest not in device.config["router_dest"]:
+                raise KeyError('Invalid router destination')
+        if (mono_mix is not None and
+                mono_mix not in device.config["mixer_out"]):
+            raise KeyError('Invalid mixer output')
+        self.mono_mix = mono_mix
+
+        # monitored buses: all buses of all speaker sets
+        self.buses = list()
+        for buses in speaker_sets.values():
+            self.buses.extend(bus for bus in buses if bus not in self.buses)
+
+        self.cut = False
+        self.dimmed = False
+        self.mono = False
+        self.speakers = None
+        self._undo = dict()  # operation -> settings that disengage it
+
+        # precomputed batches
+        self._cut_settings = [(('postroute_mute', bus), scarlett.MUTE)
+                              for bus in sorted(device.config["signal_out"])]
+        self._cut_transfers = device.encode_settings(self._cut_settings)
+        self._speaker_batches = dict()
+        for name, buses in speaker_sets.items():
+            settings = [(('postroute_mute', bus),
+                         scarlett.UNMUTE if bus in buses else scarlett.MUTE)
+                        for bus in self.buses]
+            self._speaker_batches[name] = (settings,
+                                           device.encode_settings(settings))
+
+    def _current(self, parameter):
+        """Get the current value of a parameter from the state cache.
+
+        Raises:
+            ValueError: An error occurred when the value is unknown, i.e. it
+                has not been set since the device was opened.
+
+        """
+        if parameter in self.device.state:
+            return self.device.state[parameter]
+        raise ValueError('Unknown value of %s' % (parameter,))
+
+    def _engage(self, operation, settings, transfers=None, known_only=False):
+        """Capture the undo settings of an operation, then send it.
+
+        The undo settings restore the parameters in reverse order. With
+        known_only, parameters with unknown values are left out of them
+        instead of raising ValueError.
+
+        """
+        undo = list()
+        for setting in reversed(settings):
+            if setting is scarlett_pipeline.BARRIER:
+                undo.append(setting)
+            elif not known_only or setting[0] in self.device.state:
+                undo.append((setting[0], self._current(setting[0])))
+        self.device.apply_settings(settings, transfers,
+                                   scarlett.PRIORITY_PANIC)
+        self._undo[operation] = undo
+
+    def _disengage(self, operation):
+        """Restore the settings captured when an operation was engaged."""
+        self.device.apply_settings(self._undo[operation],
+                                   priority=scarlett.PRIORITY_PANIC)
+        del self._undo[operation]
+
+    # ____ operations _________________________________________________________
+
+    def set_cut(self, cut):
+        """Mute all output buses (True) or restore their mute states (False).
+
+        Buses whose mute state was unknown when cut was engaged stay muted.
+
+        Raises:
+            ValueError: An error occurred when a USB control transfer failed.
+
+        """
+        if cut == self.cut:
+            return
+        if cut:
+            self._engage('cut', self._cut_settings, self._cut_transfers,
+                         known_only=True)
+        else:
+            self._disengage('cut')
+        self.cut = cut
+
+    def set_dim(self, dimmed):
+        """Attenuate the monitored buses (True) or restore their gains (False).
+
+        Raises:
+            ValueError: An error occurred when the gain of a monitored bus is
+                unknown (set it with set_postroute_gain() first) or when a USB
+                control transfer failed.
+
+        """
+        if dimmed == self.dimmed:
+            return
+        if dimmed:
+            settings = [(('postroute_gain', bus),
+                         max(self._current(('postroute_gain', bus)) +
+                             self.dim_gain, -128))
+                        for bus in self.buses]
+            self._engage('dim', settings)
+        else:
+            self._disengage('dim')
+        self.dimmed = dimmed
+
+    def set_mono(self, mono):
+        """Monitor the mono sum of left and right (True) or restore (False).
+
+        The mono mix is set to the average of the amplitudes of the left and
+        right monitor mixes, element by element, and routed to both monitor
+        destinations. It is a snapshot: changes of the monitor mixes while
+        mono is engaged are not followed.
+
+        Raises:
+            ValueError: An error occurred when no mono mix is reserved (see
+                the constructor), when a monitor destination is not fed by a
+                mix (route one with route_mix() first), when it is
+                fed by the mono mix itself, when a gain of the monitor mixes
+                is unknown, or when a USB control transfer failed.
+
+        """
+        if mono == self.mono:
+            return
+        if mono:
+            if self.mono_mix is None:
+                raise ValueError('No mono mix reserved')
+            mixes = [self._current(('route', dest))
+                     for dest in self.mono_dests]
+            for mix in mixes:
+                if mix not in self.device.config["mixer_out"]:
+                    raise ValueError('Monitor source %s is not a mix' % mix)
+                if mix == self.mono_mix:
+                    raise ValueError('Monitor source %s is the mono mix'
+                                     % mix)
+            settings = list()
+            for mix_in in sorted(self.device.config["mixer_in"]):
+                amplitude = 0.0
+                for mix in mixes:
+                    gain = self._current(('mixer_gain', mix_in, mix))
+                    if gain > -128:
+                        amplitude += 10**(gain/20.0)/2
+                settings.append((('mixer_gain', mix_in, self.mono_mix),
+                                 scarlett._amplitude_to_raw(amplitude)/256.0))
+            # mix the sum before routing it
+            settings.append(scarlett_pipeline.BARRIER)
+            settings += [(('route', dest), self.mono_mix)
+                         for dest in self.mono_dests]
+            # the mono mix is reserved; its gains need not be restored
+            self._engage('mono', settings, known_only=True)
+        else:
+            self._disengage('mono')
+        self.mono = mono
+
+    def select_speakers(self, name):
+        """Unmute the buses of one speaker set and mute all other sets.
+
+        While cut is engaged, the selection only replaces the mute states
+        that are restored when cut is disengaged.
+
+        Args:
+            name (string): Name of the speaker set; must be defined in
+                self.speaker_sets.
+
+        Raises:
+            KeyError: An error occurred when trying to select an invalid
+                speaker set.
+            ValueError: An error occurred when a USB control transfer failed.
+
+        """
+        if name not in self._speaker_batches:
+            raise KeyError('Invalid speaker set')
+        settings, transfers = self._speaker_batches[name]
+        if self.cut:
+            undo = collections.OrderedDict(self._undo['cut'])
+            undo.update(settings)
+            self._undo['cut'] = list(undo.items())
+        else:
+            self.device.apply_settings(settings, transfers,
+                                       scarlett.PRIORITY_PANIC)
+        self.speakers = name
@@ -0,0 +1,260 @@
+"""Pipelined USB control transfers through the libusb asynchronous API.
+
+This module contains the PipelinedTransferEngine class, which submits several
+USB control transfers concurrently with a bounded number of transfers in
+flight, instead of waiting for each transfer to complete before starting the
+next one. Bulk operations (scene changes, matrix resets) are then bounded by
+the capacity of the bus rather than by the round-trip time of a transfer.
+
+pyusb offers only synchronous transfers, so the engine calls the asynchronous
+functions of libusb-1.0 through ctypes, on the device handle that pyusb has
+already opened (a second handle could not use interface 0 while pyusb has
+claimed it). This requires pyusb's libusb1 backend; with any other backend
+the engine cannot be constructed and ScarlettDevice keeps sending
+synchronously.
+
+Transfers to the default control endpoint are processed by the host
+controller in the order of submission. Where a command sequence must not
+overlap at all (e.g. a transfer that depends on the effect of a previous one
+having completed), the sequence can be split with BARRIER: all transfers
+before it complete before any transfer after it is submitted, and if any of
+them has failed, no transfer after it is submitted at all.
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import collections
+import ctypes
+import struct
+from ctypes import (CFUNCTYPE, POINTER, Structure, byref, c_int, c_long,
+                    c_uint, c_uint8, c_void_p)
+import scarlett
+
+
+# marker in a sequence of transfers; see module docstring
+BARRIER = object()
+
+# libusb constants
+_TRANSFER_TYPE_CONTROL = 0
+_TRANSFER_COMPLETED = 0
+_SETUP = struct.Struct('<BBHHH')  # libusb_control_setup (8 bytes)
+
+
+class _Transfer(Structure):
+    """ctypes version of struct libusb_transfer (without iso descriptors)."""
+    _fields_ = [('dev_handle', c_void_p),
+                ('flags', c_uint8),
+                ('endpoint', c_uint8),
+                ('type', c_uint8),
+                ('timeout', c_uint),
+                ('status', c_int),
+                ('length', c_int),
+                ('actual_length', c_int),
+                ('callback', c_void_p),
+                ('user_data', c_void_p),
+                ('buffer', c_void_p),
+                ('num_iso_packets', c_int)]
+
+
+class _Timeval(Structure):
+    """ctypes version of struct timeval."""
+    _fields_ = [('tv_sec', c_long),
+                ('tv_usec', c_long)]
+
+
+_CALLBACK = CFUNCTYPE(None, POINTER(_Transfer))
+
+# _____________________________________________________________________________
+
+
+class PipelinedTransferEngine(object):
+    """Issue USB control transfers concurrently with a bounded window.
+
+    The engine is driven from the calling thread: run() submits transfers,
+    handles libusb events until all of them have completed, and returns their
+    results.
+
+    """
+
+    def __init__(self, device, window=8):
+        """Construct a new PipelinedTransferEngine instance.
+
+        Args:
+            device (usb.core.Device): pyusb device to send transfers to.
+            window (int): Maximum number of transfers in flight. The default
+                value is 8.
+
+        Raises:
+            NotImplementedError: An error occurred when the libusb
+                asynchronous API is not available for the device (e.g.,
+                because pyusb uses a different backend).
+
+        """
+        backend = getattr(getattr(device, '_ctx', None), 'backend', None)
+        lib = getattr(backend, 'lib', None)
+        if (lib is None or not hasattr(backend, 'ctx') or
+                not hasattr(lib, 'libusb_submit_transfer')):
+            raise NotImplementedError('libusb asynchronous API not available')
+        self.window = window
+        self._ctx = backend.ctx
+        device._ctx.managed_open()
+        self._handle = device._ctx.handle.handle
+
+        # private prototypes, so that pyusb's own prototypes stay untouched
+        self._alloc = CFUNCTYPE(POINTER(_Transfer), c_int)(
+            ('libusb_alloc_transfer', lib))
+        self._free = CFUNCTYPE(None, POINTER(_Transfer))(
+            ('libusb_free_transfer', lib))
+        self._submit = CFUNCTYPE(c_int, POINTER(_Transfer))(
+            ('libusb_submit_transfer', lib))
+        self._cancel = CFUNCTYPE(c_int, POINTER(_Transfer))(
+            ('libusb_cancel_transfer', lib))
+        self._handle_events = CFUNCTYPE(c_int, c_void_p, POINTER(_Timeval))(
+            ('libusb_handle_events_timeout', lib))
+
+        self._completed = list()
+        self._abandoned = list()  # see _drain()
+        self._callback = _CALLBACK(self._on_complete)
+        self._tv = _Timeval(0, 100000)
+
+    def _on_complete(self, transfer):
+        """libusb callback; only records which transfer has completed."""
+        # user_data holds position + 1, since ctypes maps NULL to None
+        self._completed.append(transfer.contents.user_data - 1)
+
+    def run(self, transfers, on_complete=None, should_yield=None,
+            yield_now=None):
+        """Issue a sequence of USB control transfers.
+
+        Args:
+            transfers: Sequence of (request_type, bm_request, w_value,
+                w_index, data_or_length, timeout) tuples with the meaning of
+                pyusb's ctrl_transfer() and the timeout in ms, or BARRIER.
+            on_complete: Function that is called for every completed
+                transfer with its position in transfers, its start and end
+                time, and its result. The default value is None.
+            should_yield: Function that is called before every refill of
+                the window; if it returns True, no further transfers are
+                submitted until the transfers in flight have completed, and
+                then yield_now() is called (e.g. to let a more urgent caller
+                use the control endpoint). The default value is None, which
+                never yields.
+            yield_now: See should_yield.
+
+        Returns:
+            List with one result per transfer: the number of sent bytes for
+            send-type transfers, the received data (bytearray) for
+            receive-type transfers, or None if the transfer failed or was
+            not submitted because a transfer before a BARRIER failed.
+            Results of BARRIER items are None.
+
+        """
+        results = [None] * len(transfers)
+        pending = collections.deque(enumerate(transfers))
+        inflight = dict()  # position -> (transfer, buffer, start time)
+        failed = False
+        del self._completed[:]
+        try:
+            while pending or inflight:
+                yielding = should_yield is not None and should_yield()
+                if yielding and not inflight:
+                    yield_now()
+                    yielding = False
+                while (not yielding and pending and
+                       len(inflight) < self.window):
+                    pos, item = pending[0]
+                    if item is BARRIER:
+                        if inflight:
+                            break
+                        if failed:
+                            pending.clear()  # do not send the rest
+                            break
+                        pending.popleft()
+                        continue
+                    pending.popleft()
+                    if not self._submit_one(pos, item, inflight):
+                        failed = True
+                if inflight:
+                    self._handle_events(self._ctx, byref(self._tv))
+                while self._completed:
+                    pos = self._completed.pop(0)
+                    transfer, buf, start = inflight.pop(pos)
+                    results[pos] = self._result(transfers[pos], transfer, buf)
+                    self._free(transfer)
+                    if results[pos] is None:
+                        failed = True
+                    if on_complete is not None:
+                        on_complete(pos, start, scarlett._now(),
+                                    results[pos])
+        finally:
+            if inflight:  # left early, e.g. on_complete raised an exception
+                self._drain(inflight)
+        return results
+
+    def _drain(self, inflight):
+        """Cancel all transfers in flight and wait until libusb is done.
+
+        libusb owns the buffer of a transfer until its callback has run, so
+        the buffer must stay alive until then. If libusb fails to deliver the
+        callbacks, the remaining transfers are kept in self._abandoned and are
+        never freed.
+
+        """
+        for transfer, _, _ in inflight.values():
+            self._cancel(transfer)
+        try:
+            while inflight:
+                self._handle_events(self._ctx, byref(self._tv))
+                while self._completed:
+                    transfer, _, _ = inflight.pop(self._completed.pop(0))
+                    self._free(transfer)
+        finally:
+            self._abandoned.extend(inflight.values())
+
+    def _submit_one(self, pos, item, inflight):
+        """Allocate, fill, and submit the libusb transfer of one item.
+
+        Returns:
+            False if the transfer could not be submitted, else True.
+
+        """
+        request_type, bm_request, w_value, w_index, data, timeout = item
+        if request_type & 0x80:
+            length = data
+            buf = ctypes.create_string_buffer(_SETUP.size + length)
+        else:
+            length = len(data)
+            buf = ctypes.create_string_buffer(_SETUP.size + length)
+            payload = bytes(scarlett._to_bytearray(data))
+            ctypes.memmove(ctypes.addressof(buf) + _SETUP.size, payload,
+                           length)
+        _SETUP.pack_into(buf, 0, request_type, bm_request, w_value, w_index,
+                         length)
+        transfer = self._alloc(0)
+        if not transfer:
+            return False
+        transfer.contents.dev_handle = self._handle
+        transfer.contents.endpoint = 0
+        transfer.contents.type = _TRANSFER_TYPE_CONTROL
+        transfer.contents.timeout = timeout or 0
+        transfer.contents.length = _SETUP.size + length
+        transfer.contents.buffer = ctypes.addressof(buf)
+        transfer.contents.callback = ctypes.cast(self._callback, c_void_p)
+        transfer.contents.user_data = pos + 1
+        if self._submit(transfer) != 0:
+            self._free(transfer)
+            return False
+        inflight[pos] = (transfer, buf, scarlett._now())
+        return True
+
+    @staticmethod
+    def _result(item, transfer, buf):
+        """Get the result of a completed transfer; see run()."""
+        if transfer.contents.status != _TRANSFER_COMPLETED:
+            return None
+        actual_length = transfer.contents.actual_length
+        if item[0] & 0x80:
+            return bytearray(buf.raw[_SETUP.size:_SETUP.size + actual_length])
+        return actual_length
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""Fast restore of Scarlett device configurations from precompiled blobs.
+
+A configuration (a JSON file with device settings by name, see
+compile_config()) is compiled once into a compact binary list of
+ready-to-send USB control transfers (a "blob"), stored per serial number of
+the device. Restoring a blob opens the device and sends the transfers back to
+back, without any JSON parsing or name resolution, so that the recovery time
+after a power-cycle or replug is dominated by USB. Restoring can be triggered
+by a udev rule that starts a systemd service once the sound card of the device
+has appeared (see rules.d/50-focusrite_scarlett.rules and
+systemd/redbeet-restore@.service) or by calling restore_blob() from a running
+program.
+
+Usage:
+    scarlett_restore.py compile CONFIG.json [-o DIR]
+    scarlett_restore.py restore BLOB [--serial SERIAL]
+
+Blob format (all values little endian): magic 'RBB1' (4 bytes), number of
+transfers (uint16), then per send-type transfer: bmRequest (uint8), wValue
+(uint16), wIndex (uint16), length of data (uint8), followed by the data.
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import usb.util
+import scarlett
+
+
+BLOB_MAGIC = b'RBB1'
+BLOB_SUFFIX = '.rbs'
+
+_HEADER = struct.Struct('<4sH')
+_TRANSFER = struct.Struct('<BHHB')
+
+# product names as used in configuration files
+PRODUCT_IDS = {
+    '6i6': scarlett.ID_6I6,
+    '8i6': scarlett.ID_8I6,
+    '18i6': scarlett.ID_18I6,
+    '18i8': scarlett.ID_18I8,
+    '18i20': scarlett.ID_18I20
+}
+
+
+class CommandRecorder(object):
+    """A stand-in for a pyusb device that records all send transfers.
+
+    Passed to ScarlettDevice in place of a usb object, the setters of
+    ScarlettDevice resolve names and encode values exactly as for a real
+    device; instead of being sent, the resulting transfers are appended to
+    self.transfers.
+
+    """
+
+    def __init__(self, product_id):
+        """Construct a new CommandRecorder for a type of Scarlett device.
+
+        Args:
+            product_id (int): USB product id, e.g. scarlett.ID_18I8.
+
+        """
+        self.idProduct = product_id
+        self.transfers = list()
+
+    def ctrl_transfer(self, request_type, bm_request, w_value=0, w_index=0,
+                      data_or_length=None, timeout=None):
+        """Record a send-type transfer; mimics pyusb."""
+        if request_type & 0x80:
+            return bytearray(data_or_length)
+        self.transfers.append((bm_request, w_value, w_index,
+                               list(data_or_length)))
+        return len(data_or_length)
+
+
+def compile_config(config):
+    """Compile a configuration into a list of USB control transfers.
+
+    Args:
+        config (dict): Configuration with the keys 'serial' and 'product'
+            (e.g. "18i8") and any of the following optional settings, given
+            by the names of the device mapping:
+                'clock_source': name of the clock source
+                'sampling_rate': rate in Hz
+                'impedance': {input: "LINE" or "INST"}
+                'pad': {input: true or false}
+                'mixer_source': {mixer input: source}
+                'mixer_gain': {mix: {mixer input: gain in dB}}
+                'route': {router destination: router source}
+                'postroute_mute': {output bus: true or false}
+                'postroute_gain': {output bus: gain in dB}
+
+    Returns:
+        List of (bm_request, w_value, w_index, data) tuples.
+
+    Raises:
+        KeyError: An error occurred when the configuration contains an
+            unknown product or names that are not in the device mapping.
+
+    """
+    recorder = CommandRecorder(PRODUCT_IDS[config['product']])
+    sdev = scarlett.ScarlettDevice(recorder)
+    if 'clock_source' in config:
+        sdev.set_clock_source(config['clock_source'])
+    if 'sampling_rate' in config:
+        sdev.set_sampling_rate(config['sampling_rate'])
+    for channel, impedance in sorted(config.get('impedance', {}).items()):
+        sdev.set_impedance(channel, {'LINE': scarlett.IMPEDANCE_LINE,
+                                     'INST': scarlett.IMPEDANCE_INST
+                                     }[impedance])
+    for channel, pad in sorted(config.get('pad', {}).items()):
+        sdev.set_pad(channel, scarlett.PAD_ON if pad else scarlett.PAD_OFF)
+    for mix_in, src in sorted(config.get('mixer_source', {}).items()):
+        sdev.set_mixer_source(src, mix_in)
+    for mix_out, gains in sorted(config.get('mixer_gain', {}).items()):
+        sdev.set_mixer_gain_batch([(mix_in, mix_out, gain)
+                                   for mix_in, gain in gains.items()])
+    for dest, src in sorted(config.get('route', {}).items()):
+        sdev.route_mix(src, dest)
+    for bus, gain in sorted(config.get('postroute_gain', {}).items()):
+        sdev.set_postroute_gain(bus, gain)
+    for bus, mute in sorted(config.get('postroute_mute', {}).items()):
+        sdev.set_postroute_mute(bus, scarlett.MUTE if mute
+                                else scarlett.UNMUTE)
+    return recorder.transfers
+
+
+def pack_blob(transfers):
+    """Pack a list of USB control transfers into a blob (a byte string)."""
+    chunks = [_HEADER.pack(BLOB_MAGIC, len(transfers))]
+    for bm_request, w_value, w_index, data in transfers:
+        chunks.append(_TRANSFER.pack(bm_request, w_value, w_index, len(data)))
+        chunks.append(bytes(scarlett._to_bytearray(data)))
+    return b''.join(chunks)
+
+
+def unpack_blob(blob):
+    """Unpack a blob into a list of (bm_request, w_value, w_index, data).
+
+    Raises:
+        ValueError: An error occurred when the blob is invalid.
+
+    """
+    if len(blob) < _HEADER.size or blob[:len(BLOB_MAGIC)] != BLOB_MAGIC:
+        raise ValueError('Invalid blob')
+    _, count = _HEADER.unpack_from(blob)
+    offset = _HEADER.size
+    transfers = list()
+    for _ in range(count):
+        if offset + _TRANSFER.size > len(blob):
+            raise ValueError('Truncated blob')
+        bm_request, w_value, w_index, length = _TRANSFER.unpack_from(blob,
+                                                                     offset)
+        offset += _TRANSFER.size
+        if offset + length > len(blob):
+            raise ValueError('Truncated blob')
+        transfers.append((bm_request, w_value, w_index,
+                          blob[offset:offset + length]))
+        offset += length
+    if offset != len(blob):
+        raise ValueError('Invalid blob')
+    return transfers
+
+
+def restore_blob(device, blob):
+    """Send all transfers of a blob to a device.
+
+    Like ScarlettDevice, the kernel driver is detached from the device for
+    the duration of the restore and re-attached afterwards. snd-usb-audio
+    drives the whole sound card, so audio is interrupted while the blob is
+    sent; restore before any program opens the card.
+
+    Args:
+        device (usb.core.Device): Scarlett device to restore.
+        blob (bytes): Blob as created by pack_blob().
+
+    Raises:
+        ValueError: An error occurred when the blob is invalid or when a USB
+            control transfer failed.
+
+    """
+    transfers = unpack_blob(blob)
+    previously_attached = list()
+    for interface in range(6):
+        if device.is_kernel_driver_active(interface):
+            previously_attached.append(interface)
+            device.detach_kernel_driver(interface)
+    usb.util.claim_interface(device, 0)
+    try:
+        for bm_request, w_value, w_index, data in transfers:
+            if device.ctrl_transfer(0x21, bm_request, w_value, w_index,
+                                    data) != len(data):
+                raise ValueError('USB control transfer failed')
+    finally:
+        usb.util.release_interface(device, 0)
+        # attaching interface 0 attaches interfaces 1 and 2 as well; see
+        # ScarlettDevice.__del__()
+        for interface in previously_attached:
+            if not device.is_kernel_driver_active(interface):
+                device.attach_kernel_driver(interface)
+
+# _____________________________________________________________________________
+
+
+def main():
+    """Compile configurations into blobs or restore a blob to a device."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    subparsers = parser.add_subparsers(dest='command')
+    parser_compile = subparsers.add_parser('compile')
+    parser_compile.add_argument('config', help='configuration (JSON)')
+    parser_compile.add_argument('-o', '--output-dir', default='.',
+                                help='directory for <serial>%s' % BLOB_SUFFIX)
+    parser_restore = subparsers.add_parser('restore')
+    parser_restore.add_argument('blob', help='blob created by "compile"')
+    parser_restore.add_argument('--serial', help='serial number of device; '
+                                'default: taken from the blob file name')
+    args = parser.parse_args()
+
+    if args.command == 'compile':
+        config = json.load(open(args.config))
+        blob = pack_blob(compile_config(config))
+        filename = os.path.join(args.output_dir,
+                                config['serial'] + BLOB_SUFFIX)
+        with open(filename, 'wb') as fileobj:
+            fileobj.write(blob)
+        return 0
+
+    with open(args.blob, 'rb') as fileobj:
+        blob = fileobj.read()
+    serial = args.serial
+    if serial is None:
+        serial = os.path.basename(args.blob)[:-len(BLOB_SUFFIX)]
+    device = scarlett.find_device(serial)
+    if device is None:
+        sys.stderr.write("Device with serial %s not found.\n" % serial)
+        return 1
+    restore_blob(device, blob)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
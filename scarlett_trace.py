@@ -0,0 +1,268 @@
+"""Recording and replay of USB control transfers of Scarlett devices.
+
+This module contains the TraceWriter class, which ScarlettDevice uses to
+record every control transfer into a compact binary trace file, and functions
+to read such a trace back and to replay it to a device. Replaying can be done
+as fast as possible (e.g., to measure throughput or to quickly rebuild the
+state of a device from a known-good trace) or with the original timing of the
+recorded session.
+
+Trace file format (all values little endian):
+
+    header:  magic 'RBTR' (4 bytes), version (uint16), start time of the
+             recording in seconds since the epoch (double)
+    record:  timestamp relative to the start of the recording in s (double),
+             duration of the transfer in s (float), bmRequestType (uint8),
+             bmRequest (uint8), wValue (uint16), wIndex (uint16), wLength
+             (uint16), result (int16; bytes transferred or -1 on error),
+             payload length (uint16), followed by the payload bytes. The
+             payload holds the sent data for send-type transfers and the
+             received data for receive-type transfers.
+
+Copyright (C) 2015 Christian Friesicke <christian@friesicke.me>
+
+License: GPL3 [http://www.gnu.org/licenses/gpl.html]
+"""
+
+import collections
+import struct
+import time
+import scarlett
+
+
+TRACE_MAGIC = b'RBTR'
+TRACE_VERSION = 1
+
+_HEADER = struct.Struct('<4sHd')
+_RECORD = struct.Struct('<dfBBHHHhH')
+
+
+# A single recorded control transfer; see module docstring for the fields.
+TraceRecord = collections.namedtuple(
+    'TraceRecord',
+    ['timestamp', 'duration', 'request_type', 'bm_request', 'w_value',
+     'w_index', 'w_length', 'result', 'payload']
+)
+
+
+# _____________________________________________________________________________
+
+
+class TraceWriter(object):
+    """Write USB control transfers into a binary trace file.
+
+    Instances are attached to a ScarlettDevice (see ScarlettDevice.trace or
+    ScarlettDevice.start_trace()), which calls record() for every control
+    transfer it issues.
+
+    """
+
+    def __init__(self, fileobj, start_time=None):
+        """Construct a new TraceWriter and write the trace header.
+
+        Args:
+            fileobj: File object opened in binary write mode.
+            start_time (float): Reference time of the recording on the clock
+                used by ScarlettDevice (monotonic, if available); timestamps
+                of the records are relative to it. The default value is None,
+                which uses the time of the first recorded transfer.
+
+        """
+        self.fileobj = fileobj
+        self.start_time = start_time
+        self.fileobj.write(_HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+                                        time.time()))
+
+    def record(self, request_type, bm_request, w_value, w_index,
+               data_or_length, start, duration, result):
+        """Append a single control transfer to the trace.
+
+        Args:
+            request_type (int): bmRequestType of the transfer.
+            bm_request, w_value, w_index (int): Parameters of the transfer.
+            data_or_length: Sent data (list of byte values) for send-type
+                transfers; number of requested bytes for receive-type ones.
+            start (float): Time at which the transfer was started.
+            duration (float): Duration of the transfer in seconds.
+            result: Number of sent bytes (send-type), received data
+                (receive-type), or None if the transfer failed.
+
+        """
+        if self.start_time is None:
+            self.start_time = start
+        if isinstance(data_or_length, int):
+            w_length = data_or_length
+            payload = b''
+            if result is not None:
+                payload = scarlett._to_bytearray(result)
+        else:
+            w_length = len(data_or_length)
+            payload = scarlett._to_bytearray(data_or_length)
+        if result is None:
+            count = -1
+        elif isinstance(result, int):
+            count = result
+        else:
+            count = len(result)
+        self.fileobj.write(_RECORD.pack(start - self.start_time, duration,
+                                        request_type, bm_request, w_value,
+                                        w_index, w_length, count,
+                                        len(payload)))
+        self.fileobj.write(bytes(payload))
+
+    def close(self):
+        """Flush and close the underlying file."""
+        self.fileobj.close()
+
+
+def read_trace(fileobj):
+    """Read all records of a binary trace file.
+
+    Args:
+        fileobj: File object opened in binary read mode.
+
+    Yields:
+        TraceRecord tuples in the order in which they were recorded.
+
+    Raises:
+        ValueError: An error occurred when the file is not a valid trace.
+
+    """
+    header = fileobj.read(_HEADER.size)
+    if len(header) != _HEADER.size:
+        raise ValueError('Invalid trace file')
+    magic, version, _ = _HEADER.unpack(header)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError('Invalid trace file')
+    while True:
+        fields = fileobj.read(_RECORD.size)
+        if not fields:
+            return
+        if len(fields) != _RECORD.size:
+            raise ValueError('Truncated trace file')
+        (timestamp, duration, request_type, bm_request, w_value, w_index,
+         w_length, result, payload_len) = _RECORD.unpack(fields)
+        payload = bytearray(fileobj.read(payload_len))
+        if len(payload) != payload_len:
+            raise ValueError('Truncated trace file')
+        yield TraceRecord(timestamp, duration, request_type, bm_request,
+                          w_value, w_index, w_length, result, payload)
+
+
+def replay_trace(records, target, realtime=False, include_reads=True):
+    """Replay recorded control transfers to a device.
+
+    Args:
+        records: Iterable of TraceRecord tuples, e.g. from read_trace().
+        target: Object with a pyusb-compatible ctrl_transfer() method, e.g. a
+            ScarlettDevice, a usb.core.Device, or a StandInDevice.
+        realtime (bool): If True, transfers are issued with the timing of the
+            original recording; otherwise as fast as possible. The default
+            value is False.
+        include_reads (bool): If False, receive-type transfers (e.g. peak
+            meter reads) are skipped, which is useful to restore the state of
+            a device from a trace. The default value is True.
+
+    Returns:
+        Dictionary with the number of replayed 'transfers', the number of
+        failed transfers ('errors'), the total 'elapsed' time in seconds, and
+        the list of 'durations' of the individual transfers in seconds.
+
+    """
+    durations = list()
+    errors = 0
+    replay_start = scarlett._now()
+    for rec in records:
+        is_read = rec.request_type & 0x80
+        if is_read and not include_reads:
+            continue
+        if realtime:
+            delay = rec.timestamp - (scarlett._now() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+        if is_read:
+            data_or_length = rec.w_length
+        else:
+            data_or_length = list(rec.payload)
+        start = scarlett._now()
+        try:
+            target.ctrl_transfer(rec.request_type, rec.bm_request,
+                                 rec.w_value, rec.w_index, data_or_length)
+        except (IOError, ValueError):
+            errors += 1
+        durations.append(scarlett._now() - start)
+    return {'transfers': len(durations), 'errors': errors,
+            'elapsed': scarlett._now() - replay_start, 'durations': durations}
+
+
+# _____________________________________________________________________________
+
+
+class StandInDevice(object):
+    """A stand-in for a USB device that accepts any control transfer.
+
+    Useful to replay traces offline, e.g. to measure the overhead of the
+    software stack without the USB round-trip. Send-type transfers report all
+    bytes as sent; receive-type transfers return zero-filled data.
+
+    """
+
+    def __init__(self, latency=0.0):
+        """Construct a new StandInDevice.
+
+        Args:
+            latency (float): Simulated duration of every transfer in seconds.
+                The default value is 0.
+
+        """
+        self.latency = latency
+        self.transfers = 0
+
+    def ctrl_transfer(self, request_type, bm_request, w_value=0, w_index=0,
+                      data_or_length=None, timeout=None):
+        """Accept a control transfer; mimics usb.core.Device.ctrl_transfer."""
+        self.transfers += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if request_type & 0x80:
+            return bytearray(data_or_length or 0)
+        return len(data_or_length or [])
+
+
+# _____________________________________________________________________________
+
+
+def main():
+    """Replay a trace file from the command line and print timing stats."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('trace', help='binary trace file')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay with the original timing')
+    parser.add_argument('--no-reads', action='store_true',
+                        help='skip receive-type transfers (meter reads)')
+    parser.add_argument('--stand-in', action='store_true',
+                        help='replay to a stand-in instead of a device')
+    args = parser.parse_args()
+
+    if args.stand_in:
+        target = StandInDevice()
+    else:
+        target = scarlett.ScarlettDevice()  # try auto-detect
+    with open(args.trace, 'rb') as fileobj:
+        stats = replay_trace(read_trace(fileobj), target, args.realtime,
+                             not args.no_reads)
+
+    durations = sorted(stats['durations'])
+    print("transfers: %d, errors: %d, elapsed: %.3f s" %
+          (stats['transfers'], stats['errors'], stats['elapsed']))
+    if durations:
+        print("per transfer: median %.3f ms, max %.3f ms" %
+              (1000*durations[len(durations)//2], 1000*durations[-1]))
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())